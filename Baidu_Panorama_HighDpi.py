@@ -1,150 +1,115 @@
 import os
-import time
-import glob
-import json
-import requests
-import csv
-from PIL import Image
-from io import BytesIO
 
-def read_csv(filepath):
-    data = []
-    if os.path.exists(filepath):
-        with open(filepath, mode='r', encoding='utf-8') as f:
-            lines = csv.reader(f)
-            for line in lines:
-                data.append(line)
-        return data
-    else:
-        print(f'File path error: {filepath}')
-        return []
-
-def grab_img_baidu(url):
-    headers = {
-        "Referer": "https://map.baidu.com/",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.content
-    return None
+from pano_download import enable_cache, history_sids, get_sid
+from pipeline import PanoPipeline
+from shard_store import open_archive
+from pano_catalog import PanoCatalog
+from sid_store import SidStore
+from checkpoint import Journal, SID_RESOLVED
+from sid_index import SidIndex
+from point_source import iter_converted
 
 def getSId(bd09mc_x, bd09mc_y):
-    url = f"https://mapsv0.bdimg.com/?qt=qsdata&x={bd09mc_x}&y={bd09mc_y}&time=201709&mode=day"
-    response = requests.get(url).content.decode()
-    try:
-        sid = json.loads(response)["content"]["id"]
-        return sid
-    except:
-        print("Failed to retrieve SID")
-        return None
-
-# Convert WGS84 coordinates to BD09MC
-def wgs2bd09mc(wgs_x, wgs_y, bd_AK):
-    url = f"http://api.map.baidu.com/geoconv/v1/?coords={wgs_x},{wgs_y}&from=1&to=6&output=json&ak={bd_AK}"
-    response = requests.get(url).content.decode()
-    try:
-        result = json.loads(response)
-        if result['status'] == 0:
-            return result['result'][0]['x'], result['result'][0]['y']
-    except:
-        print("Coordinate conversion failed")
-        return None, None
-
-def merge_images_horizontally(image_paths, save_path):
-    images = [Image.open(img) for img in image_paths]
-    widths, heights = zip(*(img.size for img in images))
-    total_width = sum(widths)
-    max_height = max(heights)
-
-    merged_image = Image.new('RGB', (total_width, max_height))
-    
-    x_offset = 0
-    for img in images:
-        merged_image.paste(img, (x_offset, 0))
-        x_offset += img.size[0]
-
-    merged_image.save(save_path)
-    print(f"Row merged: {save_path}")
-    return save_path 
-
-def merge_images_vertically(image1_path, image2_path, final_save_path):
-    img1 = Image.open(image1_path)
-    img2 = Image.open(image2_path)
-
-    total_width = max(img1.width, img2.width)
-    total_height = img1.height + img2.height
-
-    merged_image = Image.new('RGB', (total_width, total_height))
-    merged_image.paste(img1, (0, 0))
-    merged_image.paste(img2, (0, img1.height))
-
-    merged_image.save(final_save_path)
-    print(f"Final image merged: {final_save_path}")
+    return get_sid(bd09mc_x, bd09mc_y)
 
 if __name__ == "__main__":
     root = "Images_output"
     dir = "By_High_Dpi"
     fn_dir = "Data"
     read_fn = r'converted_data.csv'     # Your File Name
+    x_col, y_col = "Lon", "Lat"         # Names of the coordinate columns in csv
+    save_slices = True      # Keep the downloaded slices
+    save_rows = False       # Keep the stitched rows
+    cache_dir = "http_cache"    # Cache of qsdata/pdata responses, None to disable
+    offline = False         # Only serve responses from the cache
+    snap_radius = 10        # Points this close (m) to an already resolved point reuse its SID
+    bd_AK = None            # Your Baidu AK, set it to convert through geoconv instead of offline
+    z = 4                   # Pano zoom level: 1 (512x256) up to 5 (8192x4096, middle band from 4 up)
+    pyramid_levels = ()     # Lower pano levels built from the fetched one, e.g. (1, 2) for thumbnails; fetches the full sphere
+    history = False         # Also fetch every earlier capture listed in the sdata TimeLine of each site
+    archive_dir = None      # e.g. os.path.join(root, dir, "Archive") to pack images into shards instead of files
     
     slices_dir = os.path.join(root, dir, "Slices") 
     rows_dir = os.path.join(root, dir, "Rows")   
     final_dir = os.path.join(root, dir, "Final")  
-
-    os.makedirs(slices_dir, exist_ok=True)
-    os.makedirs(rows_dir, exist_ok=True)
-    os.makedirs(final_dir, exist_ok=True)
-
-    filenames_exist = glob.glob1(slices_dir, "*.png")
-
-    data = read_csv(os.path.join(fn_dir, read_fn))
-    header = data[0]
-    data = data[1:]
-
-    processed_sids = set()
-
-    for i, row in enumerate(data):
+    partial_root = os.path.join(root, dir, "Partial")   # Slices of panos not stitched yet
+    pyramid_dir = os.path.join(root, dir, "Pyramid")
+
+    archive = open_archive(archive_dir) if archive_dir else None
+    if archive is None:
+        os.makedirs(slices_dir, exist_ok=True)
+        os.makedirs(rows_dir, exist_ok=True)
+        os.makedirs(final_dir, exist_ok=True)
+        if pyramid_levels:
+            os.makedirs(pyramid_dir, exist_ok=True)
+    if cache_dir:
+        enable_cache(cache_dir, offline=offline)
+
+    processed_sids = SidStore(dir)    # Persistent across runs and shared with other processes
+    journal = Journal(dir)
+    sid_index = SidIndex(dir, snap_radius)
+    catalog = PanoCatalog(dir)      # sdata and output path of every pano, queryable by position
+    pipeline = PanoPipeline()
+    expanded = set()        # SIDs whose TimeLine was already scheduled this run
+
+    # Finish the panos an earlier run left half-done, reusing the slices it already fetched
+    for sid, info in journal.resume_panos():
+        print(f"Resuming pano {sid}...")
+        entry = open_archive(info["archive_dir"]).pano(sid, info["wgs_x"], info["wgs_y"]) if info.get("archive_dir") else None
+        pipeline.submit(sid, info["final_path"], info["slice_path"], info["row_path"], z=info.get("z", 4),
+                        partial_dir=info["partial_dir"],
+                        on_progress=catalog.progress_hook(info["final_path"], info.get("wgs_x"), info.get("wgs_y"),
+                                                          journal.pano_progress),
+                        pyramid_path=info.get("pyramid_path"), pyramid_levels=info.get("pyramid_levels", ()),
+                        archive=entry)
+
+    # Points are streamed in chunks and converted chunk by chunk, offline or in batches of
+    # 100 per geoconv request, so downloads start before the whole file is read
+    points = iter_converted(os.path.join(fn_dir, read_fn), x_col, y_col, bd_AK)
+    for i, wgs_x, wgs_y, bd09mc_x, bd09mc_y in points:
         print(f'Processing point {i + 1}...')
-        wgs_x, wgs_y = row[15], row[16]             # Indexes of coordinates in csv
-        bd_AK = "Your Baidu AK"          # Your Baidu AK
-        bd09mc_x, bd09mc_y = wgs2bd09mc(wgs_x, wgs_y, bd_AK)
-        if bd09mc_x is None or bd09mc_y is None:
-            continue
 
-        sid = getSId(bd09mc_x, bd09mc_y)
-        if not sid or sid in processed_sids:
+        # Reuse the SID resolved by an earlier run
+        point_key = f"{wgs_x}_{wgs_y}"
+        state, info = journal.get('point', point_key)
+        if state >= SID_RESOLVED:
+            sid = info["sid"]
+        else:
+            # A point next to an already resolved one gets the same pano, no qsdata needed
+            sid = sid_index.lookup(bd09mc_x, bd09mc_y)
+            if not sid:
+                sid = getSId(bd09mc_x, bd09mc_y)
+                if sid:
+                    sid_index.add(bd09mc_x, bd09mc_y, sid)
+            if sid:
+                journal.mark('point', point_key, SID_RESOLVED, sid=sid)
+            catalog.add_point(wgs_x, wgs_y, bd09mc_x, bd09mc_y, sid)
+        if not sid:
             continue
-
-        processed_sids.add(sid)
-
-        row1_paths = [] 
-        row2_paths = []  
-        for row in [1, 2]:
-            for col in range(0, 8): 
-                url = f"https://mapsv0.bdimg.com/?qt=pdata&sid={sid}&pos={row}_{col}&z=4"
-                img_data = grab_img_baidu(url)
-
-                if img_data:
-                    save_path = os.path.join(slices_dir, f"{wgs_x}_{wgs_y}_{sid}_{row}_{col}.png")
-                    with open(save_path, "wb") as f:
-                        f.write(img_data)
-                    print(f"Image saved: {save_path}")
-
-                    if row == 1:
-                        row1_paths.append(save_path)
-                    else:
-                        row2_paths.append(save_path)
-
-        # Ensure all 4 images per row are downloaded before merging
-        if len(row1_paths) == 8 and len(row2_paths) == 8:
-            row1_merged = os.path.join(rows_dir, f"{wgs_x}_{wgs_y}_{sid}_row1.png")
-            row2_merged = os.path.join(rows_dir, f"{wgs_x}_{wgs_y}_{sid}_row2.png")
-
-            merge_images_horizontally(row1_paths, row1_merged)
-            merge_images_horizontally(row2_paths, row2_merged)
-
+        if history:
+            # One sdata request lists every epoch of the site, only epochs not stored yet are claimed
+            if sid in expanded:
+                continue
+            expanded.add(sid)
+            sids = [capture for capture, _ in history_sids(sid)]
+        else:
+            sids = [sid]
+
+        for sid in sids:
+            if not journal.claim_pano(sid, processed_sids):
+                continue
+            # Slices are fetched on I/O threads and stitched in the process pool
             final_image_path = os.path.join(final_dir, f"{wgs_x}_{wgs_y}_{sid}_final.png")
-            merge_images_vertically(row1_merged, row2_merged, final_image_path)
-
-        time.sleep(6)
+            slice_path = os.path.join(slices_dir, f"{wgs_x}_{wgs_y}_{sid}_{{row}}_{{col}}.png") if save_slices else None
+            row_path = os.path.join(rows_dir, f"{wgs_x}_{wgs_y}_{sid}_row{{row}}.png") if save_rows else None
+            pyramid_path = os.path.join(pyramid_dir, f"{wgs_x}_{wgs_y}_{sid}_z{{z}}.png") if pyramid_levels else None
+            partial_dir = os.path.join(partial_root, sid)
+            journal.start_pano(sid, final_path=final_image_path, slice_path=slice_path, row_path=row_path,
+                               partial_dir=partial_dir, z=z, pyramid_path=pyramid_path,
+                               pyramid_levels=list(pyramid_levels), archive_dir=archive_dir, wgs_x=wgs_x, wgs_y=wgs_y)
+            pipeline.submit(sid, final_image_path, slice_path, row_path, z=z, partial_dir=partial_dir,
+                            on_progress=catalog.progress_hook(final_image_path, wgs_x, wgs_y, journal.pano_progress),
+                            pyramid_path=pyramid_path, pyramid_levels=pyramid_levels,
+                            archive=archive.pano(sid, wgs_x, wgs_y) if archive else None)
+
+    pipeline.close()
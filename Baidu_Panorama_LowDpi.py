@@ -1,12 +1,19 @@
 import re, os
-import json
-import requests
-import time, glob
+import glob
 import csv
 import traceback
 
+from pano_download import enable_cache, fetch_pano_slices, level_positions, get_sdata, history_sids, get_sid
+from stitch import complete, stitch_slices, encode_image
+from shard_store import open_archive
+from pano_catalog import PanoCatalog
+from sid_store import SidStore
+from checkpoint import Journal, SID_RESOLVED, STITCHED
+from sid_index import SidIndex
+from point_source import iter_converted, read_header
 
-# read csv
+
+# write csv
 def write_csv(filepath, data, head=None):
     if head:
         data = [head] + data
@@ -16,75 +23,16 @@ def write_csv(filepath, data, head=None):
             writer.writerow(i)
 
 
-# write csv
-def read_csv(filepath):
-    data = []
-    if os.path.exists(filepath):
-        with open(filepath, mode='r', encoding='utf-8') as f:
-            lines = csv.reader(f) 
-            for line in lines:
-                data.append(line)
-        return data
-    else:
-        print('filepath is wrong：{}'.format(filepath))
-        return []
-
-
-
-def grab_img_baidu(_url, _headers=None):
-    if _headers == None:
-        headers = {
-            "sec-ch-ua": '" Not A;Brand";v="99", "Chromium";v="90", "Google Chrome";v="90"',
-            "Referer": "https://map.baidu.com/",
-            "sec-ch-ua-mobile": "?0",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36"
-        }
-    else:
-        headers = _headers
-    response = requests.get(_url, headers=headers)
-
-    if response.status_code == 200:
-        print("SAVE!!")
-        return response.content
-    else:
-        return None
-
-
-def openUrl(_url):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36"
-    }
-    response = requests.get(_url, headers=headers)
-    if response.status_code == 200:  
-        return response.content
-    else:
-        return None
-
-
 def getSId(_bdlng, _bdlat):
     # get svid of baidu streetview
-    url = "https://mapsv0.bdimg.com/?qt=qsdata&x=%s&y=%s&time=201709&mode=day" % (
-        str(_bdlng), str(_bdlat))
-    res = openUrl(url).decode()
-    temp = json.loads(res)
-    try:
-        temp = json.loads(res)
-        sid = temp["content"]["id"]  
-        #print(sid)
-        return sid
-    except (KeyError, json.JSONDecodeError):
-        print("Error in getting svid")
-        return None
-
-def getPanoId(_sid):
-    url = "https://mapsv0.bdimg.com/?qt=sdata&sid=%s&pc=1" % (
-        str(_sid))
-    res = openUrl(url).decode()
-    temp = json.loads(res)
-    
+    return get_sid(_bdlng, _bdlat)
+
+# PIDs of the roads in the sdata of _sid; pass sdata when it was already fetched
+def getPanoId(_sid, sdata=None):
+    if sdata is None:
+        sdata = get_sdata(_sid)
     try:
-        temp = json.loads(res)
-        roads = temp['content'][0]['Roads']
+        roads = sdata['Roads']
         #print(roads)
         pids = []
         for road in roads:
@@ -93,81 +41,133 @@ def getPanoId(_sid):
                     pids.append(pano['PID'])  
         #print(pids)
         return pids
-    except (KeyError, json.JSONDecodeError):
+    except (KeyError, TypeError):
         print("Error in getting panoID")
         return []
 
 
-# Change wgs84 to baidu09
-def wgs2bd09mc(wgs_x, wgs_y):
-    # to:5/bd0911，6/BDMercator
-    url = 'http://api.map.baidu.com/geoconv/v1/?coords={}+&from=1&to=6&output=json&ak={}'.format(
-        wgs_x + ',' + wgs_y,
-        'Your Baidu AK'     # Your Baidu AK
-    )
-    res = openUrl(url).decode()
-    temp = json.loads(res)
-    bd09mc_x = 0
-    bd09mc_y = 0
-    if temp['status'] == 0:
-        bd09mc_x = temp['result'][0]['x']
-        bd09mc_y = temp['result'][0]['y']
-        #print("new coordinate: " + str(bd09mc_x) + "," + str(bd09mc_y))
-    return bd09mc_x, bd09mc_y
+# Download the first pano on the roads of sid at zoom z (1 is the single 512x256 slice), returns
+# the saved path or None. A single slice is written as downloaded, larger levels are stitched.
+# That pano is usually not sid itself, so it is archived and catalogued under its own PID and sdata.
+# archive: optional shard_store.ShardArchive the image is packed into instead of a file
+# catalog: optional PanoCatalog the pano's sdata and image path are recorded in
+def fetch_low_dpi(sid, wgs_x, wgs_y, output_dir, pitchs='0', z=1, archive=None, catalog=None):
+    sdata = get_sdata(sid)
+    pids = getPanoId(sid, sdata)
+    for h in pids:
+        positions = level_positions(z, full=True)
+        slices = fetch_pano_slices(h, z, positions)
+
+        if archive is None and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        if complete(slices, positions):
+            image_path = os.path.join(output_dir, r'%s_%s_%s_%s.png' % (wgs_x, wgs_y, h, pitchs))
+            if len(slices) == 1:
+                data = slices[positions[0]]
+            else:
+                data = encode_image(stitch_slices(slices), image_path)
+            if archive is not None:
+                archive.put(os.path.basename(image_path), data, sid=h, kind="final", z=z, wgs_x=wgs_x, wgs_y=wgs_y)
+            else:
+                with open(image_path, "wb") as f:
+                    f.write(data)
+            print(f"Image saved at: {image_path}")
+            if catalog is not None:
+                catalog.add_pano(h, sdata if h == sid else get_sdata(h), image_path, wgs_x, wgs_y)
+            return image_path
+        break
+    return None
 
 if __name__ == "__main__":
     root = "Images_output"
     dir = "By_Low_Dpi"
     fn_dir = "Data"
     read_fn = r'converted_data.csv'     # Your File Name
+    x_col, y_col = "Lon", "Lat"         # Names of the coordinate columns in csv
     error_fn = r'error_converted_data.csv'
-    filenames_exist = glob.glob1(os.path.join(root, dir), "*.png")
+    cache_dir = "http_cache"    # Cache of qsdata/sdata/pdata responses, None to disable
+    offline = False         # Only serve responses from the cache
+    snap_radius = 10        # Points this close (m) to an already resolved point reuse its SID
+    bd_AK = None            # Your Baidu AK, set it to convert through geoconv instead of offline
+    archive_dir = None      # e.g. os.path.join(root, dir, "Archive") to pack images into shards instead of files
+    output_dir = os.path.join(root, dir)
+    archive = open_archive(archive_dir) if archive_dir else None
+    if archive is not None:
+        points_exist = {"%s_%s" % point for point in archive.points()}
+    else:
+        # Saved files are named {x}_{y}_{pid}_{pitch}.png, keep the {x}_{y} part
+        points_exist = {fn.rsplit('_', 2)[0] for fn in glob.glob1(output_dir, "*.png")}
 
-    data = read_csv(os.path.join(fn_dir, read_fn))
-    header = data[0]
-    data = data[1:]
+    header = read_header(os.path.join(fn_dir, read_fn))
     error_img = []
     pitchs = '0'
-
+    z = 1                   # Pano zoom level, 1 is one 512x256 slice, 2 doubles it
+    history = False         # Also fetch every earlier capture listed in the sdata TimeLine of each site
+
+    if cache_dir:
+        enable_cache(cache_dir, offline=offline)
+    processed_sids = SidStore(dir)
+    journal = Journal(dir)
+    sid_index = SidIndex(dir, snap_radius)
+    catalog = PanoCatalog(dir)      # sdata and output path of every pano, queryable by position
+
+    # Finish the panos an earlier run claimed but did not save
+    for sid, info in journal.resume_panos():
+        print('Resuming pano {}...'.format(sid))
+        if fetch_low_dpi(sid, info["wgs_x"], info["wgs_y"], output_dir, pitchs, info.get("z", 1), archive, catalog):
+            journal.pano_progress(sid, "stitched")
+
+    expanded = set()        # SIDs whose TimeLine was already scheduled this run
     count = 1
+    # Points are streamed in chunks and converted chunk by chunk, offline or in batches of
+    # 100 per geoconv request
     # while count < 210:
-    for i in range(len(data)):
+    for i, wgs_x, wgs_y, bd09mc_x, bd09mc_y in iter_converted(os.path.join(fn_dir, read_fn), x_col, y_col, bd_AK):
         print('Processing No. {} point...'.format(i + 1))
-        # gcj_x, gcj_y, wgs_x, wgs_y = data[i][0], data[i][1], data[i][2], data[i][3]
-        wgs_x, wgs_y = data[i][15], data[i][16]
         #print("original coordinate:"+wgs_x+","+wgs_y)
 
-        try:
-            bd09mc_x, bd09mc_y = wgs2bd09mc(wgs_x, wgs_y)
-        except Exception as e:
-            print(str(e))
+        point_key = "%s_%s" % (wgs_x, wgs_y)
+
+        # If file exists, skip. With history on, earlier runs may have stored only the current
+        # capture, so the claims below decide instead
+        if not history and (point_key in points_exist or journal.done('point', point_key)):
             continue
-        flag = True
-        flag = flag and "%s_%s_%s.png" % (wgs_x, wgs_y, pitchs) in filenames_exist
 
-        # If file exists, skip
-        if (flag):
+        # Reuse the SID resolved by an earlier run
+        state, info = journal.get('point', point_key)
+        if state >= SID_RESOLVED:
+            sid = info["sid"]
+        else:
+            # A point next to an already resolved one gets the same pano, no qsdata needed
+            sid = sid_index.lookup(bd09mc_x, bd09mc_y)
+            if not sid:
+                sid = getSId(bd09mc_x, bd09mc_y)
+                if sid:
+                    sid_index.add(bd09mc_x, bd09mc_y, sid)
+            if sid:
+                journal.mark('point', point_key, SID_RESOLVED, sid=sid)
+            catalog.add_point(wgs_x, wgs_y, bd09mc_x, bd09mc_y, sid)
+        if not sid:
             continue
-        sid = getSId(bd09mc_x, bd09mc_y)
-        pids = getPanoId(sid)
-        for h in pids:
-            save_fn = os.path.join(root, dir, '%s_%s_%s.png' % (wgs_x, wgs_y, pitchs))
-            url = "https://mapsv0.bdimg.com/?qt=pdata&sid={}&pos=0_0&z=1&udt=20190619".format(h)
-            print(url)
-            img = grab_img_baidu(url)
-            output_dir = os.path.join(root, dir) 
-
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-
-            if img != None:
-                image_path = os.path.join(output_dir, r'%s_%s_%s_%s.png' % (wgs_x, wgs_y, h, pitchs))
-                with open(image_path, "wb") as f:
-                    f.write(img)
-                print(f"Image saved at: {image_path}")
-            break
+        sids = [sid]
+        if history:
+            # One sdata request lists every epoch of the site
+            if sid in expanded:
+                continue
+            expanded.add(sid)
+            sids = [capture for capture, _ in history_sids(sid)]
+
+        for sid in sids:
+            # Skip panos already fetched by this or another run
+            if not journal.claim_pano(sid, processed_sids):
+                continue
+            journal.start_pano(sid, wgs_x=wgs_x, wgs_y=wgs_y, z=z)
+
+            if fetch_low_dpi(sid, wgs_x, wgs_y, output_dir, pitchs, z, archive, catalog):
+                journal.pano_progress(sid, "stitched")
+                journal.mark('point', point_key, STITCHED)
 
-        time.sleep(6)
         count += 1
         
     if len(error_img) > 0:
@@ -1,25 +1,21 @@
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 import pandas as pd
 from pyproj import Transformer
 
-root = r'./dir'
-read_fn = "Point_sampled.csv"  # Your File Name
-df = pd.read_csv(os.path.join(root, read_fn))
-
-# EPSG:3857
-transformer = Transformer.from_crs("origin", "EPSG:3857", always_xy=True)        # use WGS84
-
-lon, lat = transformer.transform(df["X"].values, df["Y"].values)
+CHUNK_SIZE = 100000
 
-
-df_new = pd.DataFrame({
-    "FID": range(len(df)),  
+# Placeholder columns of the original converted_data.csv layout, kept for CSV output
+LEGACY_COLUMNS = {
     "Join_Count": 0,
     "TARGET_FID": 0,
     "Id": 0,
     "osm_id": 0,
     "code": 0,
-    "fclass": "residential", 
+    "fclass": "residential",
     "name": "",
     "ref": "",
     "oneway": "B",
@@ -28,11 +24,111 @@ df_new = pd.DataFrame({
     "bridge": "F",
     "tunnel": "F",
     "pid": 1,
-    "Lon": lon,
-    "Lat": lat
-})
+}
+
+
+# One Transformer per worker process and CRS pair
+@lru_cache(maxsize=None)
+def get_transformer(src_crs, dst_crs):
+    return Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+def convert_chunk(args):
+    start, x, y, src_crs, dst_crs, legacy = args
+    lon, lat = get_transformer(src_crs, dst_crs).transform(x, y)
+    columns = {"FID": range(start, start + len(x))}
+    if legacy:
+        columns.update(LEGACY_COLUMNS)
+    columns.update({"Lon": lon, "Lat": lat})
+    return pd.DataFrame(columns)
+
+def read_chunks(input_path, x_col, y_col, chunk_size):
+    start = 0
+    for chunk in pd.read_csv(input_path, usecols=[x_col, y_col], chunksize=chunk_size):
+        yield start, chunk[x_col].to_numpy(), chunk[y_col].to_numpy()
+        start += len(chunk)
+
+# Like executor.map, but keeps at most `window` chunks in flight so the input is streamed
+def bounded_map(executor, func, iterable, window):
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Writers append one converted chunk at a time, the format follows the output extension
+class CsvSink:
+    def __init__(self, path):
+        self.path = path
+        self.first = True
+
+    def write(self, df):
+        df.to_csv(self.path, index=False, mode='w' if self.first else 'a', header=self.first)
+        self.first = False
+
+    def close(self):
+        pass
+
+class ArrowSink:
+    def __init__(self, path, fmt):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.fmt = fmt
+        self.writer = None
+
+    def write(self, df):
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            if self.fmt == "parquet":
+                self.writer = self.pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            else:
+                # Feather v2 is the Arrow IPC file format, which can be written batch by batch
+                self.writer = self.pa.ipc.new_file(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+def open_sink(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return ArrowSink(path, "parquet")
+    if ext in (".feather", ".arrow"):
+        return ArrowSink(path, "feather")
+    return CsvSink(path)
+
+
+# Stream the input in chunks, transform them in worker processes and append them to the output.
+# CSV output keeps the legacy wide layout unless legacy=False; Parquet/Feather only hold FID, Lon, Lat.
+def convert_file(input_path, output_path, src_crs, dst_crs="EPSG:3857", x_col="X", y_col="Y",
+                 chunk_size=CHUNK_SIZE, workers=None, legacy=None):
+    sink = open_sink(output_path)
+    if legacy is None:
+        legacy = isinstance(sink, CsvSink)
+    total = 0
+    jobs = ((start, x, y, src_crs, dst_crs, legacy) for start, x, y in read_chunks(input_path, x_col, y_col, chunk_size))
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for df in bounded_map(executor, convert_chunk, jobs, 2 * workers):
+            sink.write(df)
+            total += len(df)
+            print(f"Converted {total} points")
+    sink.close()
+    return total
+
+
+if __name__ == "__main__":
+    root = r'./dir'
+    read_fn = "Point_sampled.csv"  # Your File Name
+    output_path = "converted_data.csv"  # .parquet or .feather for compact output
 
-output_path = "converted_data.csv"
-df_new.to_csv(output_path, index=False)
+    # EPSG:3857
+    total = convert_file(os.path.join(root, read_fn), output_path, "origin", "EPSG:3857")        # use WGS84
 
-print(f"Completed! Saved at {output_path}")
\ No newline at end of file
+    print(f"Completed! {total} points saved at {output_path}")
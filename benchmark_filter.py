@@ -0,0 +1,35 @@
+import glob
+import os
+import time
+from PIL import Image
+
+from get_BD_pano_from_tile import find_blue_pixels, filter_close_points, calculate_distance, getResolution
+
+# The original O(n^2) thinning, kept here as the reference implementation
+def filter_close_points_naive(blue_pixels, min_distance=10):
+    filtered_pixels = []
+    for pixel in blue_pixels:
+        if all(calculate_distance(pixel, p) > min_distance for p in filtered_pixels):
+            filtered_pixels.append(pixel)
+    return filtered_pixels
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    tiles_dir = "Tiles_output"
+    level = 19
+    min_distances = [getResolution(level) * 35, 10]
+
+    for tiff_path in sorted(glob.glob(os.path.join(tiles_dir, "*.tiff"))):
+        blue_pixels = find_blue_pixels(Image.open(tiff_path))
+        print(f"{os.path.basename(tiff_path)}: {len(blue_pixels)} blue pixels")
+        for min_distance in min_distances:
+            naive, t_naive = timed(filter_close_points_naive, blue_pixels, min_distance)
+            grid, t_grid = timed(filter_close_points, blue_pixels, min_distance)
+            same = len(naive) == len(grid) and all((a == b).all() for a, b in zip(naive, grid))
+            print(f"    min_distance={min_distance:>3}: kept {len(grid):>5}  "
+                  f"naive {t_naive * 1000:9.1f} ms  grid {t_grid * 1000:7.1f} ms  "
+                  f"speedup {t_naive / max(t_grid, 1e-9):7.1f}x  identical={same}")
@@ -0,0 +1,91 @@
+import json
+import shutil
+import sqlite3
+import threading
+import time
+
+DB_PATH = "checkpoint.db"
+
+# Ordered states of a point, tile or pano
+CONVERTED = 1
+SID_RESOLVED = 2
+FETCHED = 3
+STITCHED = 4
+
+
+# Crash-safe journal of crawl progress. Entries are (kind, key) -> state plus a JSON dict:
+#   point: key "{x}_{y}", data {"sid": ...} once qsdata answered
+#   tile:  key "{x}_{y}_{z}", SID_RESOLVED once every candidate of the tile was handed off
+#   pano:  key sid, data holds the output paths so unfinished panos can be resubmitted
+class Journal:
+    def __init__(self, scope, path=DB_PATH):
+        self.scope = scope
+        self.lock = threading.RLock()
+        self.active = set()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS journal (scope TEXT NOT NULL, kind TEXT NOT NULL, "
+                          "key TEXT NOT NULL, state INTEGER NOT NULL, data TEXT, updated REAL, "
+                          "PRIMARY KEY (scope, kind, key)) WITHOUT ROWID")
+
+    def get(self, kind, key):
+        with self.lock:
+            row = self.conn.execute("SELECT state, data FROM journal WHERE scope = ? AND kind = ? AND key = ?",
+                                    (self.scope, kind, key)).fetchone()
+        if row is None:
+            return 0, {}
+        return row[0], json.loads(row[1] or "{}")
+
+    def done(self, kind, key, state=STITCHED):
+        return self.get(kind, key)[0] >= state
+
+    # States only move forward; data is merged into what is already stored
+    def mark(self, kind, key, state, **data):
+        with self.lock:
+            old_state, old_data = self.get(kind, key)
+            old_data.update(data)
+            self.conn.execute("INSERT OR REPLACE INTO journal (scope, kind, key, state, data, updated) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              (self.scope, kind, key, max(state, old_state), json.dumps(old_data), time.time()))
+
+    # Unfinished panos of earlier runs, marked active so they are not claimed twice
+    def resume_panos(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT key, data FROM journal WHERE scope = ? AND kind = 'pano' AND state < ?",
+                                     (self.scope, STITCHED)).fetchall()
+            self.active.update(key for key, _ in rows)
+        return [(key, json.loads(data or "{}")) for key, data in rows]
+
+    # True if this run should fetch the pano: it is new to the SID store and not already in flight
+    def claim_pano(self, sid, sid_store):
+        with self.lock:
+            if sid in self.active or not sid_store.add(sid):
+                return False
+            self.active.add(sid)
+            return True
+
+    # Undo claim_pano for a pano that could not be started, so a later run claims it again
+    def release_pano(self, sid, sid_store):
+        with self.lock:
+            self.active.discard(sid)
+            sid_store.discard(sid)
+
+    def start_pano(self, sid, **data):
+        self.mark('pano', sid, SID_RESOLVED, **data)
+
+    # Progress callback for PanoPipeline: "fetched", "stitched" or "failed"
+    def pano_progress(self, sid, stage):
+        if stage == "fetched":
+            self.mark('pano', sid, FETCHED)
+            return
+        with self.lock:
+            self.active.discard(sid)
+        if stage == "stitched":
+            self.mark('pano', sid, STITCHED)
+            partial_dir = self.get('pano', sid)[1].get("partial_dir")
+            if partial_dir:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+
+    def close(self):
+        self.conn.close()
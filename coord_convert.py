@@ -0,0 +1,198 @@
+import time
+import numpy as np
+
+# Constants for coordinate conversion
+x_pi = 3.14159265358979324 * 3000.0 / 180.0
+pi = 3.1415926535897932384626
+a = 6378245.0  # Semi-major axis
+ee = 0.00669342162296594323  # Flattening
+
+# Correction matrices for BD09 Mercator projection
+LLBAND = [75, 60, 45, 30, 15, 0]
+LL2MC = [
+    [-0.0015702102444, 111320.7020616939, 1704480524535203, -10338987376042340, 26112667856603880, -35149669176653700,
+     26595700718403920, -10725012454188240, 1800819912950474, 82.5],
+    [0.0008277824516172526, 111320.7020463578, 647795574.6671607, -4082003173.641316, 10774905663.51142,
+     -15171875531.51559, 12053065338.62167, -5124939663.577472, 913311935.9512032, 67.5],
+    [0.00337398766765, 111320.7020202162, 4481351.045890365, -23393751.19931662, 79682215.47186455, -115964993.2797253,
+     97236711.15602145, -43661946.33752821, 8477230.501135234, 52.5],
+    [0.00220636496208, 111320.7020209128, 51751.86112841131, 3796837.749470245, 992013.7397791013, -1221952.21711287,
+     1340652.697009075, -620943.6990984312, 144416.9293806241, 37.5],
+    [-0.0003441963504368392, 111320.7020576856, 278.2353980772752, 2485758.690035394, 6070.750963243378,
+     54821.18345352118, 9540.606633304236, -2710.55326746645, 1405.483844121726, 22.5],
+    [-0.0003218135878613132, 111320.7020701615, 0.00369383431289, 823725.6402795718, 0.46104986909093,
+     2351.343141331292, 1.58060784298199, 8.77738589078284, 0.37238884252424, 7.45]]
+MCBAND = [12890594.86, 8362377.87, 5591021, 3481989.83, 1678043.12, 0]
+MC2LL = [[1.410526172116255e-8, 0.00000898305509648872, -1.9939833816331, 200.9824383106796, -187.2403703815547,
+          91.6087516669843, -23.38765649603339, 2.57121317296198, -0.03801003308653, 17337981.2],
+         [-7.435856389565537e-9, 0.000008983055097726239, -0.78625201886289, 96.32687599759846, -1.85204757529826,
+          -59.36935905485877, 47.40033549296737, -16.50741931063887, 2.28786674699375, 10260144.86],
+         [-3.030883460898826e-8, 0.00000898305509983578, 0.30071316287616, 59.74293618442277, 7.357984074871,
+          -25.38371002664745, 13.45380521110908, -3.29883767235584, 0.32710905363475, 6856817.37],
+         [-1.981981304930552e-8, 0.000008983055099779535, 0.03278182852591, 40.31678527705744, 0.65659298677277,
+          -4.44255534477492, 0.85341911805263, 0.12923347998204, -0.04625736007561, 4482777.06],
+         [3.09191371068437e-9, 0.000008983055096812155, 0.00006995724062, 23.10934304144901, -0.00023663490511,
+          -0.6321817810242, -0.00663494467273, 0.03430082397953, -0.00466043876332, 2555164.4],
+         [2.890871144776878e-9, 0.000008983055095805407, -3.068298e-8, 7.47137025468032, -0.00000353937994,
+          -0.02145144861037, -0.00001234426596, 0.00010322952773, -0.00000323890364, 826088.5]]
+
+
+# Vectorized versions of the scalar converters in get_BD_pano_from_tile.py.
+# Every function takes scalars or array-likes and returns float64 arrays.
+
+def out_of_china(lng, lat):
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    return (lng < 72.004) | (lng > 137.8347) | (lat < 0.8293) | (lat > 55.8271)
+
+def transformlat(lng, lat):
+    ret = -100.0 + 2.0 * lng + 3.0 * lat + 0.2 * lat * lat + 0.1 * lng * lat + 0.2 * np.sqrt(np.abs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * pi) + 20.0 * np.sin(2.0 * lng * pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lat * pi) + 40.0 * np.sin(lat / 3.0 * pi)) * 2.0 / 3.0
+    ret += (160.0 * np.sin(lat / 12.0 * pi) + 320 * np.sin(lat * pi / 30.0)) * 2.0 / 3.0
+    return ret
+
+def transformlng(lng, lat):
+    ret = 300.0 + lng + 2.0 * lat + 0.1 * lng * lng + 0.1 * lng * lat + 0.1 * np.sqrt(np.abs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * pi) + 20.0 * np.sin(2.0 * lng * pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lng * pi) + 40.0 * np.sin(lng / 3.0 * pi)) * 2.0 / 3.0
+    ret += (150.0 * np.sin(lng / 12.0 * pi) + 300.0 * np.sin(lng / 30.0 * pi)) * 2.0 / 3.0
+    return ret
+
+def wgs84togcj02(lng, lat):
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    dlat = transformlat(lng - 105.0, lat - 35.0)
+    dlng = transformlng(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * pi
+    magic = np.sin(radlat)
+    magic = 1 - ee * magic * magic
+    sqrtmagic = np.sqrt(magic)
+    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * pi)
+    dlng = (dlng * 180.0) / (a / sqrtmagic * np.cos(radlat) * pi)
+    outside = out_of_china(lng, lat)
+    return np.where(outside, lng, lng + dlng), np.where(outside, lat, lat + dlat)
+
+def gcj02tobd09(lng, lat):
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    z = np.sqrt(lng * lng + lat * lat) + 0.00002 * np.sin(lat * x_pi)
+    theta = np.arctan2(lat, lng) + 0.000003 * np.cos(lng * x_pi)
+    return z * np.cos(theta) + 0.0065, z * np.sin(theta) + 0.006
+
+# Coefficient matrices and ascending band edges used by the batch converters
+LL2MC_COEF = np.array(LL2MC, dtype=np.float64)
+MC2LL_COEF = np.array(MC2LL, dtype=np.float64)
+LLBAND_ASC = np.array(LLBAND[::-1], dtype=np.float64)
+MCBAND_ASC = np.array(MCBAND[::-1], dtype=np.float64)
+
+# Index into the descending LLBAND/MCBAND lists of the first band with value >= band
+def band_index(values, bands_asc):
+    idx = np.searchsorted(bands_asc, values, side='right') - 1
+    return len(bands_asc) - 1 - np.clip(idx, 0, len(bands_asc) - 1)
+
+# Batch version of convertor(): one coefficient row per point, polynomial evaluated with Horner's method
+def convertor(x, y, coef):
+    T = coef[:, 0] + coef[:, 1] * np.abs(x)
+    cB = np.abs(y) / coef[:, 9]
+    cE = coef[:, 8]
+    for k in range(7, 1, -1):
+        cE = cE * cB + coef[:, k]
+    return np.copysign(T, x), np.copysign(cE, y)
+
+def convertLL2MC(lng, lat):
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    lng, lat = np.broadcast_arrays(lng, lat)
+    shape = lng.shape
+    lng = lng.ravel()
+    lat = lat.ravel()
+    lng = np.where((lng > 180) | (lng < -180), (lng + 180.0) % 360.0 - 180.0, lng)
+    lat = np.clip(lat, -74, 74)
+    coef = LL2MC_COEF[band_index(np.abs(lat), LLBAND_ASC)]
+    x, y = convertor(lng, lat, coef)
+    return x.reshape(shape), y.reshape(shape)
+
+def convertMC2LL(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    x, y = np.broadcast_arrays(x, y)
+    shape = x.shape
+    x = x.ravel()
+    y = y.ravel()
+    coef = MC2LL_COEF[band_index(np.abs(y), MCBAND_ASC)]
+    lng, lat = convertor(x, y, coef)
+    return lng.reshape(shape), lat.reshape(shape)
+
+def bd09tomercator(lng, lat):
+    return convertLL2MC(lng, lat)
+
+def mercatortobd09(x, y):
+    return convertMC2LL(x, y)
+
+# Tile and pixel maths of get_BD_pano_from_tile.py over whole arrays
+def getResolution(level):
+    return 2.0 ** (np.asarray(level) - 18)
+
+def lnglatToTile(lng, lat, level):
+    x, _ = convertLL2MC(lng, 0)
+    _, y = convertLL2MC(0, lat)
+    res = getResolution(level)
+    return np.floor(x * res / 256).astype(np.int64), np.floor(y * res / 256).astype(np.int64)
+
+def lnglatToPixel(lng, lat, level):
+    x, _ = convertLL2MC(lng, 0)
+    _, y = convertLL2MC(0, lat)
+    res = getResolution(level)
+    tileX, tileY = np.floor(x * res / 256), np.floor(y * res / 256)
+    return np.floor(x * res - tileX * 256).astype(np.int64), np.floor(y * res - tileY * 256).astype(np.int64)
+
+def pixelToMercator(pixelX, pixelY, tileX, tileY, level):
+    res = getResolution(level)
+    return (np.asarray(tileX) * 256 + pixelX) / res, (np.asarray(tileY) * 256 + pixelY) / res
+
+def pixelToLnglat(pixelX, pixelY, tileX, tileY, level):
+    return convertMC2LL(*pixelToMercator(pixelX, pixelY, tileX, tileY, level))
+
+# Full offline chain WGS84 -> GCJ02 -> BD09 -> BD09MC, replaces the geoconv from=1&to=6 request
+def wgs84tobd09mc(lng, lat):
+    gcj_lng, gcj_lat = wgs84togcj02(lng, lat)
+    bd_lng, bd_lat = gcj02tobd09(gcj_lng, gcj_lat)
+    return bd09tomercator(bd_lng, bd_lat)
+
+
+if __name__ == "__main__":
+    # Accuracy and speed check against the scalar functions of get_BD_pano_from_tile.py
+    import get_BD_pano_from_tile as scalar
+
+    rng = np.random.default_rng(0)
+    n = 100000
+    lng = rng.uniform(73.0, 135.0, n)
+    lat = rng.uniform(4.0, 53.0, n)
+
+    start = time.perf_counter()
+    mc_x, mc_y = wgs84tobd09mc(lng, lat)
+    elapsed = time.perf_counter() - start
+    print(f"Converted {n} points in {elapsed * 1000:.1f} ms")
+
+    sample = rng.choice(n, 2000, replace=False)
+    error = 0.0
+    for i in sample:
+        gcj = scalar.wgs84togcj02(lng[i], lat[i])
+        bd = scalar.gcj02tobd09(gcj[0], gcj[1])
+        x, y = scalar.bd09tomercator(bd[0], bd[1])
+        error = max(error, abs(x - mc_x[i]), abs(y - mc_y[i]))
+    print(f"Max deviation from scalar chain: {error:.3e} m")
+
+    tileX, tileY = scalar.lnglatToTile(120.63036, 31.384998, 19)
+    pixelY, pixelX = np.divmod(np.arange(256 * 256), 256)
+    start = time.perf_counter()
+    lng, lat = pixelToLnglat(pixelX, pixelY, tileX, tileY, 19)
+    elapsed = time.perf_counter() - start
+    print(f"Converted {len(lng)} tile pixels in {elapsed * 1000:.1f} ms")
+
+    error = 0.0
+    for i in rng.choice(len(lng), 2000, replace=False):
+        ref = scalar.pixelToLnglat(pixelX[i], pixelY[i], tileX, tileY, 19)
+        error = max(error, abs(ref[0] - lng[i]), abs(ref[1] - lat[i]))
+    print(f"Max deviation from scalar pixelToLnglat: {error:.3e} deg")
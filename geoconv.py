@@ -0,0 +1,52 @@
+import json
+import numpy as np
+
+import pano_download
+
+GEOCONV_URL = "http://api.map.baidu.com/geoconv/v1/?coords={coords}&from={src}&to={dst}&output=json&ak={ak}"
+# Most coordinates geoconv accepts in one request
+MAX_BATCH = 100
+# Status codes caused by a coordinate in the batch, worth retrying in smaller batches
+POINT_ERRORS = {1, 4, 24, 25}
+
+
+def _request(points, ak, src, dst):
+    coords = ";".join(f"{x},{y}" for x, y in points)
+    response = pano_download.request(GEOCONV_URL.format(coords=coords, src=src, dst=dst, ak=ak))
+    if response is None or response.status_code != 200:
+        return None, None
+    try:
+        temp = json.loads(response.content.decode())
+    except (ValueError, UnicodeDecodeError):
+        return None, None
+    if temp.get('status') == 0 and len(temp.get('result', [])) == len(points):
+        return temp['status'], [(r['x'], r['y']) for r in temp['result']]
+    return temp.get('status'), None
+
+# Convert one batch; a batch rejected because of a bad coordinate is split in halves until
+# the failing points are isolated, everything else keeps its result
+def _convert(points, ak, src, dst):
+    status, result = _request(points, ak, src, dst)
+    if result is not None:
+        return result
+    if status in POINT_ERRORS and len(points) > 1:
+        half = len(points) // 2
+        return _convert(points[:half], ak, src, dst) + _convert(points[half:], ak, src, dst)
+    print(f"Coordinate conversion failed for {len(points)} point(s), status {status}")
+    return [(None, None)] * len(points)
+
+# Convert many points with as few geoconv requests as possible, results keep the input order.
+# from=1/to=6 is WGS84 -> BD09MC; points that failed come back as (None, None).
+def geoconv(points, ak, src=1, dst=6, batch_size=MAX_BATCH):
+    points = [(x, y) for x, y in points]
+    results = []
+    for start in range(0, len(points), batch_size):
+        results.extend(_convert(points[start:start + batch_size], ak, src, dst))
+    return results
+
+# Array version for the CSV readers and pixelToLnglat output, failed points are NaN
+def wgs2bd09mc_batch(lng, lat, ak, batch_size=MAX_BATCH):
+    results = geoconv(zip(np.ravel(lng), np.ravel(lat)), ak, batch_size=batch_size)
+    xy = np.array([(np.nan, np.nan) if x is None else (x, y) for x, y in results], dtype=np.float64)
+    xy = xy.reshape(-1, 2)
+    return xy[:, 0], xy[:, 1]
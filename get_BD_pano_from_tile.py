@@ -1,46 +1,23 @@
 import math
 import os
-import time
-import requests
-import json
 from io import BytesIO
 from PIL import Image
 import numpy as np
 
-# Constants for coordinate conversion
-x_pi = 3.14159265358979324 * 3000.0 / 180.0
-pi = 3.1415926535897932384626
-a = 6378245.0  # Semi-major axis
-ee = 0.00669342162296594323  # Flattening
-
-# Correction matrices for BD09 Mercator projection
-LLBAND = [75, 60, 45, 30, 15, 0]
-LL2MC = [
-    [-0.0015702102444, 111320.7020616939, 1704480524535203, -10338987376042340, 26112667856603880, -35149669176653700,
-     26595700718403920, -10725012454188240, 1800819912950474, 82.5],
-    [0.0008277824516172526, 111320.7020463578, 647795574.6671607, -4082003173.641316, 10774905663.51142,
-     -15171875531.51559, 12053065338.62167, -5124939663.577472, 913311935.9512032, 67.5],
-    [0.00337398766765, 111320.7020202162, 4481351.045890365, -23393751.19931662, 79682215.47186455, -115964993.2797253,
-     97236711.15602145, -43661946.33752821, 8477230.501135234, 52.5],
-    [0.00220636496208, 111320.7020209128, 51751.86112841131, 3796837.749470245, 992013.7397791013, -1221952.21711287,
-     1340652.697009075, -620943.6990984312, 144416.9293806241, 37.5],
-    [-0.0003441963504368392, 111320.7020576856, 278.2353980772752, 2485758.690035394, 6070.750963243378,
-     54821.18345352118, 9540.606633304236, -2710.55326746645, 1405.483844121726, 22.5],
-    [-0.0003218135878613132, 111320.7020701615, 0.00369383431289, 823725.6402795718, 0.46104986909093,
-     2351.343141331292, 1.58060784298199, 8.77738589078284, 0.37238884252424, 7.45]]
-MCBAND = [12890594.86, 8362377.87, 5591021, 3481989.83, 1678043.12, 0]
-MC2LL = [[1.410526172116255e-8, 0.00000898305509648872, -1.9939833816331, 200.9824383106796, -187.2403703815547,
-          91.6087516669843, -23.38765649603339, 2.57121317296198, -0.03801003308653, 17337981.2],
-         [-7.435856389565537e-9, 0.000008983055097726239, -0.78625201886289, 96.32687599759846, -1.85204757529826,
-          -59.36935905485877, 47.40033549296737, -16.50741931063887, 2.28786674699375, 10260144.86],
-         [-3.030883460898826e-8, 0.00000898305509983578, 0.30071316287616, 59.74293618442277, 7.357984074871,
-          -25.38371002664745, 13.45380521110908, -3.29883767235584, 0.32710905363475, 6856817.37],
-         [-1.981981304930552e-8, 0.000008983055099779535, 0.03278182852591, 40.31678527705744, 0.65659298677277,
-          -4.44255534477492, 0.85341911805263, 0.12923347998204, -0.04625736007561, 4482777.06],
-         [3.09191371068437e-9, 0.000008983055096812155, 0.00006995724062, 23.10934304144901, -0.00023663490511,
-          -0.6321817810242, -0.00663494467273, 0.03430082397953, -0.00466043876332, 2555164.4],
-         [2.890871144776878e-9, 0.000008983055095805407, -3.068298e-8, 7.47137025468032, -0.00000353937994,
-          -0.02145144861037, -0.00001234426596, 0.00010322952773, -0.00000323890364, 826088.5]]
+from coord_convert import x_pi, pi, a, ee, LLBAND, LL2MC, MCBAND, MC2LL
+import coord_convert
+import road_sampler
+import pano_download
+import stitch
+from pipeline import PanoPipeline
+from shard_store import open_archive
+from pano_catalog import PanoCatalog
+from sid_store import SidStore
+from checkpoint import Journal, SID_RESOLVED
+from sid_index import SidIndex
+import geoconv
+import tile_planner
+import tile_sink
 
 
 def gcj02tobd09(lng, lat):
@@ -225,137 +202,133 @@ def pixelYToLat(pixelY, tileY, level):
 def pixelToLnglat(pixelX, pixelY, tileX, tileY, level):
     return mercatortobd09((tileX * 256 + pixelX) / getResolution(level), (tileY * 256 + pixelY) / getResolution(level))
 
-def wgs2bd09mc(wgs_x, wgs_y, ak):
-    url = f'http://api.map.baidu.com/geoconv/v1/?coords={wgs_x},{wgs_y}&from=1&to=6&output=json&ak={ak}'
-    response = requests.get(url)
-    temp = json.loads(response.text)
-    if temp['status'] == 0:
-        return temp['result'][0]['x'], temp['result'][0]['y']
-
 def get_baidu_sid(lng, lat):
-    url = f"https://mapsv0.bdimg.com/?qt=qsdata&x={lng}&y={lat}&time=201709&mode=day"
-    response = requests.get(url).content.decode()
-    try:
-        sid = json.loads(response)["content"]["id"]
-        return sid
-    except:
-        print("Failed to retrieve SID")
-        return None
+    return pano_download.get_sid(lng, lat)
 
-def get_baidu_pano(wgs_x, wgs_y, bd09mc_x, bd09mc_y):
+# Fetch one pano for the point (wgs_x, wgs_y) unless it was already claimed. Returns False if skipped.
+def save_baidu_pano(sid, wgs_x, wgs_y, save_slices=True, save_rows=False, pipeline=None, journal=None,
+                    z=4, pyramid_levels=(), sector=None, archive=None):
     root = "Images_output"
     dir = "By_Tile"
     slices_dir = os.path.join(root, dir, "Slices") 
     rows_dir = os.path.join(root, dir, "Rows")   
     final_dir = os.path.join(root, dir, "Final")  
+    pyramid_dir = os.path.join(root, dir, "Pyramid")
+
+    if archive is None:
+        os.makedirs(slices_dir, exist_ok=True)
+        os.makedirs(rows_dir, exist_ok=True)
+        os.makedirs(final_dir, exist_ok=True)
+        if pyramid_levels:
+            os.makedirs(pyramid_dir, exist_ok=True)
+
+    if journal:
+        if not journal.claim_pano(sid, get_sid_store()):
+            print("    Already fetched! Continue......")
+            return False
+    elif check_SID(sid) == 0:
+        print("    Already fetched! Continue......")
+        return False
+
+    # A sector is a crop, not a 2:1 pano, so it is kept apart from the *_final.png panos
+    suffix = "sector" if sector else "final"
+    final_image_path = os.path.join(final_dir, f"{wgs_x}_{wgs_y}_{sid}_{suffix}.png")
+    slice_path = os.path.join(slices_dir, f"{wgs_x}_{wgs_y}_{sid}_{{row}}_{{col}}.png") if save_slices else None
+    row_path = os.path.join(rows_dir, f"{wgs_x}_{wgs_y}_{sid}_row{{row}}.png") if save_rows else None
+    pyramid_path = os.path.join(pyramid_dir, f"{wgs_x}_{wgs_y}_{sid}_z{{z}}.png") if pyramid_levels else None
+    positions = None
+    if sector:
+        heading, fov = sector[:2]
+        pitch_range = sector[2] if len(sector) > 2 else None
+        pano_heading = pano_download.get_pano_heading(sid)
+        if pano_heading is None:
+            # Without the heading the sector cannot be placed; leave the pano for a later run
+            if journal:
+                journal.release_pano(sid, get_sid_store())
+            else:
+                get_sid_store().discard(sid)
+            return False
+        positions = pano_download.sector_positions(z, heading, fov, pitch_range, pano_heading)
+    entry = archive.pano(sid, wgs_x, wgs_y) if archive is not None else None
+    if pipeline is not None:
+        partial_dir = os.path.join(root, dir, "Partial", sid) if journal else None
+        on_progress = get_catalog().progress_hook(final_image_path, wgs_x, wgs_y)
+        if journal:
+            journal.start_pano(sid, final_path=final_image_path, slice_path=slice_path, row_path=row_path,
+                               partial_dir=partial_dir, z=z, positions=positions, pyramid_path=pyramid_path,
+                               pyramid_levels=list(pyramid_levels),
+                               archive_dir=archive.archive_dir if archive is not None else None,
+                               wgs_x=wgs_x, wgs_y=wgs_y)
+            on_progress = get_catalog().progress_hook(final_image_path, wgs_x, wgs_y, journal.pano_progress)
+        pipeline.submit(sid, final_image_path, slice_path, row_path, z=z, positions=positions, partial_dir=partial_dir,
+                        on_progress=on_progress, pyramid_path=pyramid_path, pyramid_levels=pyramid_levels,
+                        archive=entry)
+        return True
 
-    os.makedirs(slices_dir, exist_ok=True)
-    os.makedirs(rows_dir, exist_ok=True)
-    os.makedirs(final_dir, exist_ok=True)
-
-    sid = get_baidu_sid(bd09mc_x, bd09mc_y)
+    # All slices of the level are fetched concurrently over the shared connection pool
+    positions = positions or pano_download.level_positions(z, full=bool(pyramid_levels))
+    slices = pano_download.fetch_pano_slices(sid, z, positions)
+
+    if stitch.complete(slices, positions):
+        get_catalog().add_pano(sid, pano_download.get_sdata(sid), final_image_path, wgs_x, wgs_y)
+        stitch.save_panorama(slices, final_image_path, slice_path, row_path, pyramid_path, z, pyramid_levels, entry)
+    return True
+
+# SIDs whose TimeLine was already scheduled this run
+expanded_sids = set()
+
+# pipeline: optional PanoPipeline that fetches and stitches in the background
+# journal: optional checkpoint Journal, used with the pipeline to make the crawl resumable
+# z: zoom level fetched; pyramid_levels: lower levels derived from it and saved under Pyramid,
+# the full sphere is fetched for them (from z=4 up only the middle band is fetched otherwise)
+# sector: optional (heading, fov) or (heading, fov, (low_pitch, high_pitch)) in degrees, only the
+# slices covering it are fetched and stitched, relative to the pano heading from sdata, and saved
+# as *_sector.png
+# archive: optional shard_store.ShardArchive the images are packed into instead of files
+# history: also fetch every earlier capture of the site listed in its sdata TimeLine; one sdata
+# request covers all epochs and epochs already stored are skipped
+def get_baidu_pano(wgs_x, wgs_y, bd09mc_x, bd09mc_y, save_slices=True, save_rows=False, pipeline=None, journal=None,
+                   z=4, pyramid_levels=(), sector=None, archive=None, history=False):
+    point_key = f"{wgs_x}_{wgs_y}"
+    state, info = journal.get('point', point_key) if journal else (0, {})
+    if state >= SID_RESOLVED:
+        sid = info["sid"]
+    else:
+        # A point next to an already resolved one gets the same pano, no qsdata needed
+        sid = get_sid_index().lookup(bd09mc_x, bd09mc_y)
+        if sid is None:
+            sid = get_baidu_sid(bd09mc_x, bd09mc_y)
+            if sid is not None:
+                get_sid_index().add(bd09mc_x, bd09mc_y, sid)
+        get_catalog().add_point(wgs_x, wgs_y, bd09mc_x, bd09mc_y, sid)
     if sid == None:
         return None
-    if check_SID(sid) == 0:
-        print("    Already fetched! Continue......")
-        return None
-
-    row1_paths = [] 
-    row2_paths = []  
-    for row in [1, 2]:
-        for col in range(0, 8): 
-            url = f"https://mapsv0.bdimg.com/?qt=pdata&sid={sid}&pos={row}_{col}&z=4"
-            img_data = grab_img_baidu(url)
-
-            if img_data:
-                img_byte_arr = BytesIO()
-                img_data.save(img_byte_arr, format='PNG')
-                img_byte_arr = img_byte_arr.getvalue()
-
-                save_path = os.path.join(slices_dir, f"{wgs_x}_{wgs_y}_{sid}_{row}_{col}.png")
-                with open(save_path, "wb") as f:
-                    f.write(img_byte_arr) 
-
-                print(f"    Image saved: {save_path}")
-
-                if row == 1:
-                    row1_paths.append(save_path)
-                else:
-                    row2_paths.append(save_path)
-
-    if len(row1_paths) == 8 and len(row2_paths) == 8:
-        row1_merged = os.path.join(rows_dir, f"{wgs_x}_{wgs_y}_{sid}_row1.png")
-        row2_merged = os.path.join(rows_dir, f"{wgs_x}_{wgs_y}_{sid}_row2.png")
-
-        merge_images_horizontally(row1_paths, row1_merged)
-        merge_images_horizontally(row2_paths, row2_merged)
-
-        final_image_path = os.path.join(final_dir, f"{wgs_x}_{wgs_y}_{sid}_final.png")
-        merge_images_vertically(row1_merged, row2_merged, final_image_path)
-
-def merge_images_horizontally(image_paths, save_path):
-    images = [Image.open(img) for img in image_paths]
-    widths, heights = zip(*(img.size for img in images))
-    total_width = sum(widths)
-    max_height = max(heights)
-
-    merged_image = Image.new('RGB', (total_width, max_height))
-    
-    x_offset = 0
-    for img in images:
-        merged_image.paste(img, (x_offset, 0))
-        x_offset += img.size[0]
-
-    merged_image.save(save_path)
-    print(f"    Row merged: {save_path}")
-    return save_path 
-
-def merge_images_vertically(image1_path, image2_path, final_save_path):
-    img1 = Image.open(image1_path)
-    img2 = Image.open(image2_path)
-
-    total_width = max(img1.width, img2.width)
-    total_height = img1.height + img2.height
-
-    merged_image = Image.new('RGB', (total_width, total_height))
-    merged_image.paste(img1, (0, 0))
-    merged_image.paste(img2, (0, img1.height))
-
-    merged_image.save(final_save_path)
-    print(f"    Final image merged: {final_save_path}")
-
+    if journal:
+        journal.mark('point', point_key, SID_RESOLVED, sid=sid)
+
+    sids = [sid]
+    if history:
+        if sid in expanded_sids:
+            return None
+        expanded_sids.add(sid)
+        sids = [capture for capture, _ in pano_download.history_sids(sid)]
+    for capture in sids:
+        save_baidu_pano(capture, wgs_x, wgs_y, save_slices, save_rows, pipeline, journal, z, pyramid_levels, sector,
+                        archive)
+    return sid
+
+# Coverage tile decoded, downloaded through the shared session, rate limiter and cache
 def grab_img_baidu(url):
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        img = Image.open(BytesIO(response.content)) 
-        return img
-    else:
+    content = pano_download.grab_img_baidu(url)
+    if content is None:
         print("     Error in Downloading Baidu images")
         return None
+    return Image.open(BytesIO(content))
 
 def convert_to_tiff(img, tileX, tileY, scale, output_dir="Tiles_output"):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    tiff_filename = f"{tileX}_{tileY}_{scale}.tiff"
-    tiff_path = os.path.join(output_dir, tiff_filename)
-
-    img = img.convert("RGB")
-    img.save(tiff_path, format="TIFF")
-    print(f"    Tile saved at: {tiff_path}")    
-    return tiff_path
+    return tile_sink.TiffSink(output_dir, compression=None).write(img, tileX, tileY, scale)
 
 
-def load_existing_panoids(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            return set(file.read().splitlines()) 
-    return set()
-
-def save_panoid(file_path, panoid):
-    with open(file_path, 'a') as file:
-        file.write(f"{panoid}\n")
-
 def find_blue_pixels(img):
     img = img.convert("RGB")
     img_array = np.array(img) 
@@ -370,47 +343,131 @@ def calculate_distance(p1, p2):
     return np.sqrt((p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2)
 
 def filter_close_points(blue_pixels, min_distance=10):
+    # Same greedy result as checking every kept pixel, but kept pixels are hashed into
+    # a grid of min_distance cells so each pixel only looks at its 3x3 neighbourhood
+    cell = min_distance if min_distance > 0 else 1
+    min_sq = min_distance * min_distance
+    grid = {}
     filtered_pixels = []
     for pixel in blue_pixels:
-        if all(calculate_distance(pixel, p) > min_distance for p in filtered_pixels):
+        y, x = int(pixel[0]), int(pixel[1])
+        cy, cx = int(y // cell), int(x // cell)
+        close = False
+        for ny in (cy - 1, cy, cy + 1):
+            for nx in (cx - 1, cx, cx + 1):
+                for py, px in grid.get((ny, nx), ()):
+                    if (py - y) ** 2 + (px - x) ** 2 <= min_sq:
+                        close = True
+                        break
+                if close:
+                    break
+            if close:
+                break
+        if not close:
+            grid.setdefault((cy, cx), []).append((y, x))
             filtered_pixels.append(pixel)
     return filtered_pixels
 
-def check_SID(sid):
-    panoid_file = "panoids.txt"
-    existing_panoids = load_existing_panoids(panoid_file)
+# Opened on first use; SIDs from the old panoids.txt are imported into the store
+sid_store = None
+
+def get_sid_store():
+    global sid_store
+    if sid_store is None:
+        sid_store = SidStore("By_Tile", legacy_txt="panoids.txt")
+    return sid_store
 
-    new_panoid = sid
-    if new_panoid not in existing_panoids:
-        save_panoid(panoid_file, new_panoid)
+# Grid index of already resolved query points, opened on first use
+sid_index = None
+
+def get_sid_index():
+    global sid_index
+    if sid_index is None:
+        sid_index = SidIndex("By_Tile")
+    return sid_index
+
+# Metadata catalog of the fetched panos, opened on first use
+catalog = None
+
+def get_catalog():
+    global catalog
+    if catalog is None:
+        catalog = PanoCatalog("By_Tile")
+    return catalog
+
+def check_SID(sid):
+    if get_sid_store().add(sid):
         return 1
     else:
         return 0
 
-def get_pano_by_tiles(tileX, tileY, scale, ak):  
-    url = f"https://mapsv0.bdimg.com/tile/?udt=20200825&qt=tile&styles=pl&x={tileX}&y={tileY}&z={scale}"
+# Candidate query points of one coverage tile, [(wgs_lng, wgs_lat, bd09mc_x, bd09mc_y), ...],
+# or None when the tile itself could not be downloaded
+# sample_spacing: metres between candidates along each skeletonized road line,
+# None falls back to thinning every blue pixel
+# sink: tile_sink writer for the downloaded tile, None keeps it in memory only
+# index: SidIndex whose resolved points skip the online conversion, get_sid_index() by default
+def tile_points(tileX, tileY, scale, ak=None, sample_spacing=35, pipeline=None, sink=None, index=None):
+    url = tile_planner.TILE_URL.format(x=tileX, y=tileY, z=scale)
 
     img = grab_img_baidu(url)
     if img is None:
-        return
-    tiff_path = convert_to_tiff(img, tileX, tileY, scale)
-
-    blue_pixel_coords = find_blue_pixels(img)
+        return None
+    if sink is not None:
+        if sink.encodes and pipeline is not None:
+            pipeline.submit_cpu(sink.write, img, tileX, tileY, scale)
+        else:
+            sink.write(img, tileX, tileY, scale)
+
+    if sample_spacing is None:
+        blue_pixel_coords = find_blue_pixels(img)
+        min_distance = getResolution(scale) * 35
+    else:
+        # BD09MC units are metres and one pixel is 1 / getResolution(scale) of them
+        spacing_px = getResolution(scale) * sample_spacing
+        blue_pixel_coords = road_sampler.sample_road_pixels(img, spacing_px)
+        min_distance = spacing_px / 2
     if len(blue_pixel_coords) <= 0 :
-        return
+        return []
     print(f"    Detected {len(blue_pixel_coords)} blue pixels.")
 
-    filtered_coords = filter_close_points(blue_pixel_coords, min_distance=getResolution(scale)*35)
+    filtered_coords = filter_close_points(blue_pixel_coords, min_distance=min_distance)
     if len(filtered_coords) <= 0 :
-        return
+        return []
     print(f"    After filtering, {len(filtered_coords)} blue pixels remained.")
 
+    pixels = np.asarray(filtered_coords)
+    lnglats = np.column_stack(coord_convert.pixelToLnglat(pixels[:, 1], pixels[:, 0], tileX, tileY, scale))
+    # Convert every point of the tile offline in one vectorized call
+    bd09mc = np.column_stack(coord_convert.wgs84tobd09mc(lnglats[:, 0], lnglats[:, 1]))
+    if ak is not None:
+        # Online conversion, in one batched request, only for points not covered by an already resolved pano
+        index = index or get_sid_index()
+        online = np.array([index.lookup(x, y) is None for x, y in bd09mc], dtype=bool)
+        if online.any():
+            bd09mc[online] = np.column_stack(geoconv.wgs2bd09mc_batch(lnglats[online, 0], lnglats[online, 1], ak))
+
+    points = []
     for i, (pixelY, pixelX) in enumerate(filtered_coords):
-            wgs_lng, wgs_lat = pixelToLnglat(pixelX, pixelY, tileX, tileY, scale)
-            bd09mc_lng, bd09mc_lat = wgs2bd09mc(wgs_lng, wgs_lat, ak)
+            wgs_lng, wgs_lat = lnglats[i]
+            bd09mc_lng, bd09mc_lat = bd09mc[i]
+            if np.isnan(bd09mc_lng):
+                continue
             print(f"    Blue pixel No. {i + 1}:  pixel position: (x={pixelX}, y={pixelY}) -> WGS84: (lng={wgs_lng}, lat={wgs_lat})")
-            get_baidu_pano(wgs_lng, wgs_lat, bd09mc_lng, bd09mc_lat)
-            time.sleep(3)
+            points.append((wgs_lng, wgs_lat, bd09mc_lng, bd09mc_lat))
+    return points
+
+# z, pyramid_levels, sector, archive, history: passed on to get_baidu_pano
+# Returns False when the tile itself could not be downloaded
+def get_pano_by_tiles(tileX, tileY, scale, ak=None, sample_spacing=35, pipeline=None, journal=None, sink=None,
+                      z=4, pyramid_levels=(), sector=None, archive=None, history=False):
+    points = tile_points(tileX, tileY, scale, ak, sample_spacing, pipeline, sink)
+    if points is None:
+        return False
+    for wgs_lng, wgs_lat, bd09mc_lng, bd09mc_lat in points:
+        get_baidu_pano(wgs_lng, wgs_lat, bd09mc_lng, bd09mc_lat, pipeline=pipeline, journal=journal,
+                       z=z, pyramid_levels=pyramid_levels, sector=sector, archive=archive, history=history)
+    return True
 
 def get_tile_range(first_lng, first_lat, end_lng, end_lat, level):
     tileX1, tileY1 = lnglatToTile(first_lng, first_lat, level)
@@ -423,17 +480,60 @@ def get_tile_range(first_lng, first_lat, end_lng, end_lat, level):
     return tile_coordinates
 
 if __name__ == "__main__":
-    ak = "Your Baidu AK"  # Your API Key
+    ak = None  # Your Baidu AK, only needed to convert coordinates online through geoconv
     first_lng, first_lat = 120.63036,31.384998    # Top-left corner coordinates
     end_lng, end_lat = 120.644374,31.379819      # Bottom-right corner coordinates
     level = 19
-    tiles = get_tile_range(first_lng, first_lat, end_lng, end_lat, level)
+    z = 4                   # Pano zoom level: 1 (512x256) up to 5 (8192x4096, middle band from 4 up)
+    pyramid_levels = ()     # Lower pano levels built from the fetched one, e.g. (1, 2) for thumbnails; fetches the full sphere
+    sector = None           # (heading, fov) in degrees to fetch only that part of each pano, None for all
+    history = False         # Also fetch every earlier capture listed in the sdata TimeLine of each site
+    archive_dir = None      # e.g. "Images_output/By_Tile/Archive" to pack images into shards instead of files
+    archive = open_archive(archive_dir) if archive_dir else None
+    cache_dir = "http_cache"    # Cache of tile/qsdata/pdata responses, None to disable
+    offline = False         # Only serve responses from the cache
+    snap_radius = 10        # Points this close (m) to an already resolved point reuse its SID
+    tile_output = "tiff"    # "none", "tiff" (one compressed TIFF per tile) or "mosaic" (one tiled GeoTIFF)
+    coarse_levels = (15, 17)    # Coverage levels checked first to skip empty tiles, () to scan every tile
+    sid_index = SidIndex("By_Tile", snap_radius)
+    if cache_dir:
+        pano_download.enable_cache(cache_dir, offline=offline)
+    if coarse_levels:
+        tiles, coarse_requests = tile_planner.plan_tiles(first_lng, first_lat, end_lng, end_lat, level, coarse_levels)
+        print(f"Coverage check: {coarse_requests} coarse tile requests")
+    else:
+        tiles = get_tile_range(first_lng, first_lat, end_lng, end_lat, level)
     print("Tile numbers: " + str(len(tiles)))
     j = len(tiles)
     i = 0
+    journal = Journal("By_Tile")
+    sink = tile_sink.open_tile_sink(tile_output, tiles=tiles, scale=level)
+    pipeline = PanoPipeline()
+
+    # Finish the panos an earlier run left half-done, reusing the slices it already fetched
+    for sid, info in journal.resume_panos():
+        print(f"Resuming pano {sid}...")
+        positions = [tuple(pos) for pos in info["positions"]] if info.get("positions") else None
+        entry = open_archive(info["archive_dir"]).pano(sid, info["wgs_x"], info["wgs_y"]) if info.get("archive_dir") else None
+        pipeline.submit(sid, info["final_path"], info["slice_path"], info["row_path"], z=info.get("z", 4),
+                        positions=positions, partial_dir=info["partial_dir"],
+                        on_progress=get_catalog().progress_hook(info["final_path"], info.get("wgs_x"),
+                                                                info.get("wgs_y"), journal.pano_progress),
+                        pyramid_path=info.get("pyramid_path"), pyramid_levels=info.get("pyramid_levels", ()),
+                        archive=entry)
+
     for tile in tiles:
         i += 1
         j -= 1
-        get_pano_by_tiles(tile[0], tile[1], level, ak)
+        tile_key = f"{tile[0]}_{tile[1]}_{level}"
+        if journal.done('tile', tile_key, SID_RESOLVED):
+            print(f"    Tile No. {i} already scanned, {j} remaining")
+            continue
+        if get_pano_by_tiles(tile[0], tile[1], level, ak, pipeline=pipeline, journal=journal, sink=sink,
+                             z=z, pyramid_levels=pyramid_levels, sector=sector, archive=archive,
+                             history=history):
+            journal.mark('tile', tile_key, SID_RESOLVED)
         print(f"    Processing Tile No. {i}，{j} remaining")
+    pipeline.close()
+    sink.close()
 
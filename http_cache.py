@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from rate_limit import endpoint_of
+
+DAY = 24 * 3600
+# Seconds a cached response stays valid per endpoint, None never expires
+TTLS = {
+    "tile": 30 * DAY,
+    "pdata": None,        # slices of a SID never change
+    "qsdata": 30 * DAY,
+    "sdata": 30 * DAY,
+    "geoconv": None,      # pure function of the input
+    "other": DAY,
+}
+MAX_BYTES = 20 * 1024 ** 3
+# Eviction trims down to this fraction of max_bytes so it does not run on every put
+EVICT_TO = 0.9
+
+
+def _json(content):
+    try:
+        return json.loads(content.decode())
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+def _has_id(data):
+    try:
+        return bool(data["content"]["id"])
+    except (KeyError, TypeError):
+        return False
+
+def _has_sdata(data):
+    try:
+        return bool(data["content"][0])
+    except (KeyError, IndexError, TypeError):
+        return False
+
+# Whether a 200 body is a real answer worth caching. Baidu reports quota and lookup errors
+# inside 200 responses, which would otherwise be served from the cache for the whole TTL.
+def valid_response(url, content):
+    if not content:
+        return False
+    endpoint = endpoint_of(url)
+    if endpoint == "geoconv":
+        data = _json(content)
+        return isinstance(data, dict) and data.get("status") == 0
+    if endpoint == "qsdata":
+        return _has_id(_json(content))
+    if endpoint == "sdata":
+        return _has_sdata(_json(content))
+    return True
+
+# Query parameters are sorted and the scheme/host lower-cased so equivalent URLs share an entry
+def normalize_url(url):
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+
+# Disk cache of response bodies. Bodies are stored once per SHA-256 of their content (many empty
+# tiles share one blob) and an SQLite index maps normalized URLs to them. Least recently used
+# entries are evicted once the blobs exceed max_bytes.
+class HttpCache:
+    def __init__(self, cache_dir="http_cache", max_bytes=MAX_BYTES, ttls=None, offline=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttls = dict(TTLS, **(ttls or {}))
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), timeout=30,
+                                    check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, digest TEXT NOT NULL, "
+                          "size INTEGER NOT NULL, stored REAL NOT NULL, accessed REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+        # Running size of the blobs, recomputed from the index whenever eviction runs
+        self.total = self.total_bytes()
+
+    def blob_path(self, digest):
+        return os.path.join(self.cache_dir, "blobs", digest[:2], digest)
+
+    def get(self, url):
+        key = normalize_url(url)
+        with self.lock:
+            row = self.conn.execute("SELECT digest, stored FROM entries WHERE url = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            digest, stored = row
+            ttl = self.ttls.get(endpoint_of(url))
+            # Offline mode serves stale entries rather than nothing
+            if ttl is not None and time.time() - stored > ttl and not self.offline:
+                return None
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE url = ?", (time.time(), key))
+        try:
+            with open(self.blob_path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, content):
+        key = normalize_url(url)
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            self.total += len(content)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT digest FROM entries WHERE url = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO entries (url, digest, size, stored, accessed) "
+                              "VALUES (?, ?, ?, ?, ?)", (key, digest, len(content), now, now))
+            if old and old[0] != digest:
+                self._drop_blob_if_unused(old[0])
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def _drop_blob_if_unused(self, digest):
+        if self.conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    # Size of the distinct blobs on disk
+    def total_bytes(self):
+        row = self.conn.execute("SELECT SUM(size) FROM (SELECT digest, MAX(size) AS size FROM entries "
+                                "GROUP BY digest)").fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        with self.lock:
+            total = self.total_bytes()
+            rows = self.conn.execute("SELECT url, digest, size FROM entries ORDER BY accessed").fetchall()
+            for url, digest, size in rows:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                self.conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+                if self.conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+                    total -= size
+                    self._drop_blob_if_unused(digest)
+            self.total = total
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,128 @@
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import coord_convert
+import pano_download
+
+DB_PATH = "catalog.db"
+
+
+# sdata gives positions in BD09MC centimetres
+def _sdata_position(sdata):
+    try:
+        return float(sdata["X"]) / 100, float(sdata["Y"]) / 100
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Catalog of fetched panos and the query points that led to them. Panos keep their sdata
+# (capture date, heading, road name, full JSON) and output location; their BD09MC positions
+# are in an R*Tree, so radius and coverage queries never scan the table or the output folders.
+class PanoCatalog:
+    def __init__(self, scope, path=DB_PATH):
+        self.scope = scope
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS panos (id INTEGER PRIMARY KEY, scope TEXT NOT NULL, "
+                          "sid TEXT NOT NULL, date TEXT, heading REAL, road TEXT, x REAL, y REAL, "
+                          "wgs_x TEXT, wgs_y TEXT, path TEXT, sdata TEXT, updated REAL, UNIQUE (scope, sid))")
+        self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS panos_rtree USING rtree(id, min_x, max_x, min_y, max_y)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS points (scope TEXT NOT NULL, wgs_x TEXT NOT NULL, "
+                          "wgs_y TEXT NOT NULL, x REAL, y REAL, sid TEXT, updated REAL, "
+                          "PRIMARY KEY (scope, wgs_x, wgs_y)) WITHOUT ROWID")
+
+    # Record a pano from its sdata content (pano_download.get_sdata), keeping the source point
+    # and where its image was written. Without a position in sdata, x/y fall back to the point's.
+    def add_pano(self, sid, sdata=None, path=None, wgs_x=None, wgs_y=None, x=None, y=None):
+        sdata = sdata or {}
+        sx, sy = _sdata_position(sdata)
+        if sx is not None:
+            x, y = sx, sy
+        values = (self.scope, sid, sdata.get("Date"), _float(sdata.get("Heading")), sdata.get("Rname"),
+                  x, y, None if wgs_x is None else str(wgs_x), None if wgs_y is None else str(wgs_y), path,
+                  json.dumps(sdata, ensure_ascii=False) if sdata else None, time.time())
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("INSERT INTO panos (scope, sid, date, heading, road, x, y, wgs_x, wgs_y, path, "
+                                  "sdata, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                                  "ON CONFLICT (scope, sid) DO UPDATE SET "
+                                  "date = COALESCE(excluded.date, date), heading = COALESCE(excluded.heading, heading), "
+                                  "road = COALESCE(excluded.road, road), x = COALESCE(excluded.x, x), "
+                                  "y = COALESCE(excluded.y, y), wgs_x = COALESCE(excluded.wgs_x, wgs_x), "
+                                  "wgs_y = COALESCE(excluded.wgs_y, wgs_y), path = COALESCE(excluded.path, path), "
+                                  "sdata = COALESCE(excluded.sdata, sdata), updated = excluded.updated", values)
+                pano_id, px, py = self.conn.execute("SELECT id, x, y FROM panos WHERE scope = ? AND sid = ?",
+                                                    (self.scope, sid)).fetchone()
+                if px is not None:
+                    self.conn.execute("INSERT OR REPLACE INTO panos_rtree (id, min_x, max_x, min_y, max_y) "
+                                      "VALUES (?, ?, ?, ?, ?)", (pano_id, px, px, py, py))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    # Record a query point and the SID qsdata gave for it (None when it has no coverage)
+    def add_point(self, wgs_x, wgs_y, x, y, sid=None):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO points (scope, wgs_x, wgs_y, x, y, sid, updated) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (self.scope, str(wgs_x), str(wgs_y), _float(x), _float(y), sid, time.time()))
+
+    # Progress callback for PanoPipeline: records the pano once its slices arrived (on the fetch
+    # thread, where the sdata request does not hold anything up), then calls on_progress
+    def progress_hook(self, path=None, wgs_x=None, wgs_y=None, on_progress=None):
+        def hook(sid, stage):
+            if stage == "fetched":
+                self.add_pano(sid, pano_download.get_sdata(sid), path, wgs_x, wgs_y)
+            if on_progress:
+                on_progress(sid, stage)
+        return hook
+
+    # (sid, date, heading, road, path, distance) of panos within radius metres of a BD09MC
+    # position, nearest first
+    def panos_within(self, x, y, radius):
+        # CROSS JOIN keeps SQLite from scanning panos first instead of the R*Tree
+        rows = self.conn.execute("SELECT p.sid, p.date, p.heading, p.road, p.path, p.x, p.y FROM panos_rtree r "
+                                 "CROSS JOIN panos p ON p.id = r.id WHERE r.min_x <= ? AND r.max_x >= ? AND "
+                                 "r.min_y <= ? AND r.max_y >= ? AND p.scope = ?",
+                                 (x + radius, x - radius, y + radius, y - radius, self.scope)).fetchall()
+        result = []
+        for sid, date, heading, road, path, px, py in rows:
+            distance = ((px - x) ** 2 + (py - y) ** 2) ** 0.5
+            if distance <= radius:
+                result.append((sid, date, heading, road, path, distance))
+        return sorted(result, key=lambda r: r[-1])
+
+    # Same for a WGS84 position, converted offline
+    def panos_within_wgs(self, lng, lat, radius):
+        x, y = coord_convert.wgs84tobd09mc(lng, lat)
+        return self.panos_within(float(np.asarray(x)), float(np.asarray(y)), radius)
+
+    # (wgs_x, wgs_y) of the points qsdata found no pano for, plus, with a radius, those with
+    # no catalogued pano within radius metres
+    def points_without_coverage(self, radius=None):
+        if radius is None:
+            return self.conn.execute("SELECT wgs_x, wgs_y FROM points WHERE scope = ? AND sid IS NULL",
+                                     (self.scope,)).fetchall()
+        return self.conn.execute("SELECT wgs_x, wgs_y FROM points pt WHERE scope = ? AND (sid IS NULL OR NOT EXISTS "
+                                 "(SELECT 1 FROM panos_rtree r CROSS JOIN panos p ON p.id = r.id WHERE "
+                                 "r.min_x <= pt.x + ? AND r.max_x >= pt.x - ? AND r.min_y <= pt.y + ? AND "
+                                 "r.max_y >= pt.y - ? AND p.scope = pt.scope AND "
+                                 "(p.x - pt.x) * (p.x - pt.x) + (p.y - pt.y) * (p.y - pt.y) <= ? * ?))",
+                                 (self.scope, radius, radius, radius, radius, radius, radius)).fetchall()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,319 @@
+import argparse
+import os
+
+import pano_download
+import rate_limit
+import tile_planner
+import tile_sink
+from checkpoint import Journal, SID_RESOLVED
+from get_BD_pano_from_tile import get_tile_range, tile_points
+from pano_catalog import PanoCatalog
+from pipeline import PanoPipeline
+from point_source import iter_converted
+from road_crawler import Frontier, crawl, wgs_polygon
+from shard_store import open_archive
+from sid_index import SidIndex, SNAP_RADIUS
+from sid_store import SidStore
+
+# Usage, one process per run; every mode shares the fetch settings, journal and sinks:
+#   python pano_cli.py points Data/converted_data.csv --x-col Lon --y-col Lat
+#   python pano_cli.py tiles --bbox 120.63036 31.384998 120.644374 31.379819 --tile-output mosaic
+#   python pano_cli.py roads --seed <SID> --area 120.63036,31.384998 120.644374,31.384998 120.644374,31.379819
+#   python pano_cli.py --concurrency 32 --rate pdata=30:24 --z 5 --archive points Data/converted_data.csv
+
+
+# Source, fetch engine and sinks of one run. Sources hand it query points (point) or panos
+# found some other way (pano); panos are claimed once through the journal, fetched on the
+# pipeline's I/O threads and stitched and written by its process pool.
+class Crawler:
+    def __init__(self, output_dir, scope, z=4, pyramid_levels=(), sector=None, history=False,
+                 save_slices=False, save_rows=False, archive_dir=None, snap_radius=SNAP_RADIUS, workers=None):
+        self.output_dir = output_dir
+        self.z = z
+        self.pyramid_levels = tuple(pyramid_levels)
+        self.sector = sector
+        self.history = history
+        self.save_slices = save_slices
+        self.save_rows = save_rows
+        self.archive = open_archive(archive_dir) if archive_dir else None
+        self.journal = Journal(scope)
+        self.sid_store = SidStore(scope)
+        self.sid_index = SidIndex(scope, snap_radius)
+        self.catalog = PanoCatalog(scope)
+        self.pipeline = PanoPipeline(workers)
+        self.expanded = set()       # SIDs whose TimeLine was already scheduled this run
+        self.dirs = {name: os.path.join(output_dir, name) for name in ("Slices", "Rows", "Final", "Pyramid", "Partial")}
+        if self.archive is None:
+            os.makedirs(self.dirs["Final"], exist_ok=True)
+
+    # Finish the panos an earlier run left half-done, reusing the slices it already fetched
+    def resume(self):
+        for sid, info in self.journal.resume_panos():
+            print(f"Resuming pano {sid}...")
+            positions = [tuple(pos) for pos in info["positions"]] if info.get("positions") else None
+            entry = open_archive(info["archive_dir"]).pano(sid, info.get("wgs_x"), info.get("wgs_y")) \
+                if info.get("archive_dir") else None
+            self.pipeline.submit(sid, info["final_path"], info.get("slice_path"), info.get("row_path"),
+                                 z=info.get("z", 4), positions=positions, partial_dir=info["partial_dir"],
+                                 on_progress=self.catalog.progress_hook(info["final_path"], info.get("wgs_x"),
+                                                                        info.get("wgs_y"), self.journal.pano_progress),
+                                 pyramid_path=info.get("pyramid_path"), pyramid_levels=info.get("pyramid_levels", ()),
+                                 archive=entry)
+
+    # SID of a query point: from an earlier run, a nearby resolved point or qsdata
+    def resolve(self, wgs_x, wgs_y, x, y):
+        point_key = f"{wgs_x}_{wgs_y}"
+        state, info = self.journal.get('point', point_key)
+        if state >= SID_RESOLVED:
+            return info["sid"]
+        sid = self.sid_index.lookup(x, y)
+        if sid is None:
+            sid = pano_download.get_sid(x, y)
+            if sid is not None:
+                self.sid_index.add(x, y, sid)
+        if sid is not None:
+            self.journal.mark('point', point_key, SID_RESOLVED, sid=sid)
+        self.catalog.add_point(wgs_x, wgs_y, x, y, sid)
+        return sid
+
+    # Every capture of the site when history is on, each site expanded once per run
+    def captures(self, sid, sdata=None):
+        if not self.history:
+            return [sid]
+        if sid in self.expanded:
+            return []
+        self.expanded.add(sid)
+        return [capture for capture, _ in pano_download.history_sids(sid, sdata)]
+
+    def point(self, wgs_x, wgs_y, x, y):
+        sid = self.resolve(wgs_x, wgs_y, x, y)
+        if sid is None:
+            return None
+        for capture in self.captures(sid):
+            self.pano(capture, wgs_x, wgs_y)
+        return sid
+
+    # Schedule one pano unless it was already claimed, returns its final path or None.
+    # With sdata (road crawl) the pano is already catalogued and no sdata request is repeated.
+    def pano(self, sid, wgs_x=None, wgs_y=None, sdata=None):
+        if not self.journal.claim_pano(sid, self.sid_store):
+            return None
+        name = sid if wgs_x is None else f"{wgs_x}_{wgs_y}_{sid}"
+        # A sector is a crop, not a 2:1 pano, so it is kept apart from the *_final.png panos
+        suffix = "sector" if self.sector else "final"
+        final_path = os.path.join(self.dirs["Final"], f"{name}_{suffix}.png")
+        slice_path = os.path.join(self.dirs["Slices"], f"{name}_{{row}}_{{col}}.png") if self.save_slices else None
+        row_path = os.path.join(self.dirs["Rows"], f"{name}_row{{row}}.png") if self.save_rows else None
+        pyramid_path = os.path.join(self.dirs["Pyramid"], f"{name}_z{{z}}.png") if self.pyramid_levels else None
+        for path in (slice_path, row_path, pyramid_path):
+            if path and self.archive is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        positions = None
+        if self.sector:
+            heading, fov = self.sector[:2]
+            pitch_range = self.sector[2] if len(self.sector) > 2 else None
+            try:
+                pano_heading = float(sdata["Heading"])
+            except (KeyError, TypeError, ValueError):
+                pano_heading = pano_download.get_pano_heading(sid)
+            if pano_heading is None:
+                # Without the heading the sector cannot be placed; leave the pano for a later run
+                self.journal.release_pano(sid, self.sid_store)
+                return None
+            positions = pano_download.sector_positions(self.z, heading, fov, pitch_range, pano_heading)
+        partial_dir = os.path.join(self.dirs["Partial"], sid)
+        self.journal.start_pano(sid, final_path=final_path, slice_path=slice_path, row_path=row_path,
+                                partial_dir=partial_dir, z=self.z, positions=positions, pyramid_path=pyramid_path,
+                                pyramid_levels=list(self.pyramid_levels),
+                                archive_dir=self.archive.archive_dir if self.archive is not None else None,
+                                wgs_x=wgs_x, wgs_y=wgs_y)
+        if sdata is None:
+            on_progress = self.catalog.progress_hook(final_path, wgs_x, wgs_y, self.journal.pano_progress)
+        else:
+            on_progress = self.journal.pano_progress
+        self.pipeline.submit(sid, final_path, slice_path, row_path, z=self.z, positions=positions,
+                             partial_dir=partial_dir, on_progress=on_progress, pyramid_path=pyramid_path,
+                             pyramid_levels=self.pyramid_levels,
+                             archive=self.archive.pano(sid, wgs_x, wgs_y) if self.archive is not None else None)
+        return final_path
+
+    def close(self):
+        self.pipeline.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+# Sources. Points are streamed in chunks and converted chunk by chunk, so downloads start
+# before the whole file is read; tiles are scanned one at a time and marked once all their
+# points were handed on.
+
+def point_source(args):
+    for i, wgs_x, wgs_y, x, y in iter_converted(args.path, args.x_col, args.y_col, args.ak):
+        print(f'Processing point {i + 1}...')
+        yield wgs_x, wgs_y, x, y
+
+def tile_source(args, crawler):
+    first_lng, first_lat, end_lng, end_lat = args.bbox
+    if args.coarse_levels:
+        tiles, coarse_requests = tile_planner.plan_tiles(first_lng, first_lat, end_lng, end_lat, args.level,
+                                                         args.coarse_levels)
+        print(f"Coverage check: {coarse_requests} coarse tile requests")
+    else:
+        tiles = get_tile_range(first_lng, first_lat, end_lng, end_lat, args.level)
+    print("Tile numbers: " + str(len(tiles)))
+    sink = tile_sink.open_tile_sink(args.tile_output, args.tile_dir, tiles=tiles, scale=args.level)
+    try:
+        for i, (tileX, tileY) in enumerate(tiles):
+            tile_key = f"{tileX}_{tileY}_{args.level}"
+            if crawler.journal.done('tile', tile_key, SID_RESOLVED):
+                print(f"    Tile No. {i + 1} already scanned, {len(tiles) - i - 1} remaining")
+                continue
+            points = tile_points(tileX, tileY, args.level, args.ak, args.sample_spacing, crawler.pipeline, sink,
+                                 crawler.sid_index)
+            if points is None:
+                continue
+            yield from points
+            crawler.journal.mark('tile', tile_key, SID_RESOLVED)
+            print(f"    Processing Tile No. {i + 1}，{len(tiles) - i - 1} remaining")
+    finally:
+        sink.close()
+
+def run_roads(args, crawler):
+    def on_pano(pid, sdata):
+        path = None
+        for capture in crawler.captures(pid, sdata):
+            path = crawler.pano(capture, sdata=sdata if capture == pid else None) or path
+        return path
+
+    frontier = Frontier(args.scope)
+    polygon = wgs_polygon(args.area)
+    total = crawl(args.seed, polygon, frontier, crawler.catalog, batch_size=args.concurrency,
+                  max_panos=args.max_panos, on_pano=on_pano)
+    frontier.close()
+    print(f"{total} panos expanded")
+
+
+# "pdata=30" or "pdata=30:24" as {"pdata": (30.0, 24)}; the burst defaults to the endpoint's
+def parse_rate(value):
+    try:
+        endpoint, spec = value.split("=", 1)
+        rate, _, burst = spec.partition(":")
+        rate = float(rate)
+        burst = int(burst) if burst else rate_limit.RATES.get(endpoint, (rate, max(1, int(rate))))[1]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected ENDPOINT=RPS[:BURST], got {value!r}")
+    if endpoint not in rate_limit.RATES:
+        raise argparse.ArgumentTypeError(f"unknown endpoint {endpoint!r}, expected one of {sorted(rate_limit.RATES)}")
+    return endpoint, (rate, burst)
+
+def parse_floats(value):
+    try:
+        return tuple(float(v) for v in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma separated numbers, got {value!r}")
+
+def parse_levels(value):
+    try:
+        return tuple(int(v) for v in value.split(",") if v)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma separated levels, got {value!r}")
+
+def parse_sector(value):
+    numbers = parse_floats(value)
+    if len(numbers) == 2:
+        return numbers
+    if len(numbers) == 4:
+        return numbers[0], numbers[1], numbers[2:]
+    raise argparse.ArgumentTypeError(f"expected HEADING,FOV or HEADING,FOV,LOW,HIGH, got {value!r}")
+
+def parse_vertex(value):
+    numbers = parse_floats(value)
+    if len(numbers) != 2:
+        raise argparse.ArgumentTypeError(f"expected LNG,LAT, got {value!r}")
+    return numbers
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Download Baidu street view panoramas from points, map tiles or "
+                                                 "the road graph, with one set of fetch and output settings.")
+    fetch = parser.add_argument_group("fetch")
+    fetch.add_argument("--concurrency", type=int, default=pano_download.MAX_CONCURRENCY,
+                       help="requests in flight across all panos")
+    fetch.add_argument("--retries", type=int, default=pano_download.MAX_RETRIES)
+    fetch.add_argument("--rate", type=parse_rate, action="append", default=[], metavar="ENDPOINT=RPS[:BURST]",
+                       help=f"request rate of one endpoint ({', '.join(rate_limit.RATES)}), repeatable")
+    fetch.add_argument("--cache-dir", default="http_cache", help="response cache, '' to disable")
+    fetch.add_argument("--max-bytes", type=int, default=None, help="size cap of the response cache")
+    fetch.add_argument("--offline", action="store_true", help="only serve responses from the cache")
+    fetch.add_argument("--workers", type=int, default=None, help="stitching processes")
+    fetch.add_argument("--ak", default=None, help="Baidu AK, converts coordinates online through geoconv")
+    fetch.add_argument("--snap-radius", type=float, default=SNAP_RADIUS,
+                       help="points this close (m) to a resolved point reuse its SID")
+
+    output = parser.add_argument_group("output")
+    output.add_argument("--output-dir", default=None, help="default Images_output/By_<mode>")
+    output.add_argument("--scope", default=None, help="journal and catalog scope, default the output folder name")
+    output.add_argument("--z", type=int, default=4, choices=sorted(pano_download.SLICE_GRID), help="pano zoom level")
+    output.add_argument("--pyramid-levels", type=parse_levels, default=(), metavar="Z,Z",
+                        help="lower levels built from the fetched one, fetches the full sphere")
+    output.add_argument("--sector", type=parse_sector, default=None, metavar="HEADING,FOV[,LOW,HIGH]",
+                        help="only fetch the slices covering this view, in degrees, saved as *_sector.png")
+    output.add_argument("--history", action="store_true", help="also fetch every earlier capture of each site")
+    output.add_argument("--slices", action="store_true", help="keep the downloaded slices")
+    output.add_argument("--rows", action="store_true", help="keep the stitched rows")
+    output.add_argument("--archive", action="store_true", help="pack images into shards under <output-dir>/Archive")
+
+    modes = parser.add_subparsers(dest="mode", required=True)
+    points = modes.add_parser("points", help="points of a CSV, Parquet or Feather file")
+    points.add_argument("path")
+    points.add_argument("--x-col", default="Lon")
+    points.add_argument("--y-col", default="Lat")
+
+    tiles = modes.add_parser("tiles", help="road coverage tiles of a bounding box")
+    tiles.add_argument("--bbox", type=float, nargs=4, required=True,
+                       metavar=("FIRST_LNG", "FIRST_LAT", "END_LNG", "END_LAT"))
+    tiles.add_argument("--level", type=int, default=19)
+    tiles.add_argument("--coarse-levels", type=parse_levels, default=tile_planner.COARSE_LEVELS, metavar="L,L",
+                       help="coverage levels checked first to skip empty tiles, '' to scan every tile")
+    tiles.add_argument("--sample-spacing", type=float, default=35, help="metres between points along a road")
+    tiles.add_argument("--tile-output", choices=tile_sink.SINK_MODES, default="tiff")
+    tiles.add_argument("--tile-dir", default="Tiles_output")
+
+    roads = modes.add_parser("roads", help="walk the pano graph inside a polygon")
+    roads.add_argument("--seed", action="append", required=True, help="SID inside the area, repeatable")
+    roads.add_argument("--area", type=parse_vertex, nargs="+", required=True, metavar="LNG,LAT",
+                       help="WGS84 vertices of the area")
+    roads.add_argument("--max-panos", type=int, default=None)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.offline and not args.cache_dir:
+        parser.error("--offline serves responses from the cache and needs --cache-dir")
+    args.output_dir = args.output_dir or os.path.join("Images_output", f"By_{args.mode.capitalize()}")
+    args.scope = args.scope or os.path.basename(os.path.normpath(args.output_dir))
+
+    # Fetch settings apply to every request of the process, whatever the mode
+    pano_download.configure(args.concurrency, args.retries)
+    rate_limit.configure(dict(args.rate))
+    if args.cache_dir:
+        pano_download.enable_cache(args.cache_dir, args.max_bytes, offline=args.offline)
+
+    crawler = Crawler(args.output_dir, args.scope, args.z, args.pyramid_levels, args.sector, args.history,
+                      args.slices, args.rows, os.path.join(args.output_dir, "Archive") if args.archive else None,
+                      args.snap_radius, args.workers)
+    try:
+        crawler.resume()
+        if args.mode == "roads":
+            run_roads(args, crawler)
+        else:
+            source = point_source(args) if args.mode == "points" else tile_source(args, crawler)
+            for wgs_x, wgs_y, x, y in source:
+                crawler.point(wgs_x, wgs_y, x, y)
+    finally:
+        crawler.close()
+    print("Completed!")
+
+
+if __name__ == "__main__":
+    main()
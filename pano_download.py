@@ -0,0 +1,271 @@
+import asyncio
+import json
+import math
+import os
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+import rate_limit
+from http_cache import HttpCache, valid_response
+
+HEADERS = {
+    "Referer": "https://map.baidu.com/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36"
+}
+
+# Global cap on requests in flight, shared by every pano being downloaded
+MAX_CONCURRENCY = 16
+# Retries after a throttling status or a connection error
+MAX_RETRIES = 3
+
+QSDATA_URL = "https://mapsv0.bdimg.com/?qt=qsdata&x={x}&y={y}&time={time}&mode=day"
+PDATA_URL = "https://mapsv0.bdimg.com/?qt=pdata&sid={sid}&pos={row}_{col}&z={z}"
+SDATA_URL = "https://mapsv0.bdimg.com/?qt=sdata&sid={sid}&pc=1"
+# Slice grid at z=4: rows 1-2, columns 0-7
+SLICE_ROWS = [1, 2]
+SLICE_COLS = list(range(0, 8))
+# (rows, cols) of the full 512 px slice grid per zoom level, each level doubles the previous one
+SLICE_GRID = {1: (1, 1), 2: (1, 2), 3: (2, 4), 4: (4, 8), 5: (8, 16)}
+
+
+def make_session(pool_size=MAX_CONCURRENCY):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+# One keep-alive connection pool and one worker pool for the whole process
+session = make_session()
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+# Response cache, off until enable_cache() is called
+cache = None
+
+
+# Resize the connection and worker pools and set the retry count, for every mode at once
+def configure(concurrency=None, retries=None):
+    global MAX_CONCURRENCY, MAX_RETRIES, session, executor
+    if retries is not None:
+        MAX_RETRIES = retries
+    if concurrency is not None and concurrency != MAX_CONCURRENCY:
+        MAX_CONCURRENCY = concurrency
+        old_session, old_executor = session, executor
+        session = make_session(concurrency)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        old_executor.shutdown(wait=False)
+        old_session.close()
+
+# offline=True serves everything from the cache and never touches the network
+def enable_cache(cache_dir="http_cache", max_bytes=None, ttls=None, offline=False):
+    global cache
+    kwargs = {"max_bytes": max_bytes} if max_bytes else {}
+    cache = HttpCache(cache_dir, ttls=ttls, offline=offline, **kwargs)
+    return cache
+
+def cached_response(url, content):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = content
+    response.encoding = "utf-8"
+    return response
+
+
+# GET through the shared session, paced by the per-endpoint rate limiter. Throttling
+# responses and connection errors slow the endpoint down and are retried with backoff.
+def request(url, headers=None, _session=None, retries=None):
+    if retries is None:
+        retries = MAX_RETRIES
+    if cache is not None:
+        content = cache.get(url)
+        # Error bodies cached before they were screened out are ignored and fetched again
+        if content is not None and valid_response(url, content):
+            return cached_response(url, content)
+        if cache.offline:
+            return None
+
+    response = None
+    for attempt in range(retries + 1):
+        rate_limit.limiter.wait(url)
+        try:
+            response = (_session or session).get(url, headers=headers, timeout=30)
+        except requests.RequestException as e:
+            print(f"    Request failed: {url}: {e}")
+        else:
+            if response.status_code not in rate_limit.BACKOFF_STATUS:
+                rate_limit.limiter.success(url)
+                if cache is not None and response.status_code == 200 and valid_response(url, response.content):
+                    cache.put(url, response.content)
+                return response
+        delay = rate_limit.limiter.throttled(url)
+        if attempt < retries:
+            time.sleep(delay)
+    return response
+
+def grab_img_baidu(url, _session=None):
+    response = request(url, _session=_session)
+    if response is not None and response.status_code == 200:
+        return response.content
+    return None
+
+async def fetch_urls(urls):
+    loop = asyncio.get_running_loop()
+    tasks = [loop.run_in_executor(executor, grab_img_baidu, url) for url in urls]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+def slice_positions(rows=None, cols=None):
+    return [(row, col) for row in (rows or SLICE_ROWS) for col in (cols or SLICE_COLS)]
+
+# Slices fetched at zoom z. From z=4 up only the middle half of the rows is kept by default
+# (rows 1-2 at z=4, the band the crawlers always used); full=True returns the whole sphere.
+def level_positions(z, full=False):
+    if z not in SLICE_GRID:
+        raise ValueError(f"Unsupported zoom level {z}, expected one of {sorted(SLICE_GRID)}")
+    rows, cols = SLICE_GRID[z]
+    if full or rows < 4:
+        row_range = range(rows)
+    else:
+        row_range = range(rows // 4, rows * 3 // 4)
+    return slice_positions(list(row_range), list(range(cols)))
+
+# SID of the pano nearest to a BD09MC position from qt=qsdata, None when there is no coverage
+def get_sid(bd09mc_x, bd09mc_y, time="201709"):
+    response = request(QSDATA_URL.format(x=bd09mc_x, y=bd09mc_y, time=time))
+    try:
+        return json.loads(response.content.decode())["content"]["id"]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        print("Failed to retrieve SID")
+        return None
+
+# qt=sdata metadata of a pano (ID, X/Y, Date, Heading, Rname, Roads, TimeLine...), None on failure
+def get_sdata(sid):
+    response = request(SDATA_URL.format(sid=sid))
+    if response is None or response.status_code != 200:
+        return None
+    try:
+        return json.loads(response.content.decode())["content"][0]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+# Every capture of the site of sid as [(sid, epoch)], from the TimeLine of its sdata, the given
+# sid first. Epochs are the "201709"-style strings of the TimeLine, None when unknown.
+def history_sids(sid, sdata=None):
+    if sdata is None:
+        sdata = get_sdata(sid)
+    captures = {sid: None}
+    for entry in (sdata or {}).get("TimeLine") or []:
+        try:
+            captures.setdefault(entry["ID"], entry.get("TimeLine") or entry.get("Year"))
+            if entry["ID"] == sid:
+                captures[sid] = entry.get("TimeLine") or entry.get("Year")
+        except (KeyError, TypeError):
+            continue
+    return list(captures.items())
+
+# Heading in degrees of the centre column of a pano, from its qt=sdata metadata; None when unknown,
+# since guessing would fetch and journal the wrong slices for a sector
+def get_pano_heading(sid):
+    try:
+        return float(get_sdata(sid)["Heading"])
+    except (KeyError, TypeError, ValueError):
+        print(f"    No heading for {sid}")
+        return None
+
+# Slices at zoom z covering a view of fov degrees around heading (degrees from north, the pano
+# faces pano_heading at its centre column). Columns are returned left to right, wrapping past
+# column 0 if needed. pitch_range=(low, high) in degrees selects rows of the full sphere,
+# None keeps the rows of level_positions(z). The sector widens with the pitch, since a
+# pitched view spans more longitude.
+def sector_positions(z, heading, fov, pitch_range=None, pano_heading=0.0):
+    positions = level_positions(z)
+    rows, cols = SLICE_GRID[z]
+    if pitch_range is None:
+        row_range = sorted({row for row, _ in positions})
+        max_pitch = 0.0
+    else:
+        low, high = sorted(pitch_range)
+        low, high = max(low, -90.0), min(high, 90.0)
+        first = int((90.0 - high) / 180.0 * rows)
+        last = min(int(math.ceil((90.0 - low) / 180.0 * rows)), rows) - 1
+        row_range = list(range(first, max(last, first) + 1))
+        max_pitch = min(max(abs(low), abs(high)), 89.0)
+    half = fov / 2 / math.cos(math.radians(max_pitch))
+    if half >= 180:
+        col_range = list(range(cols))
+    else:
+        centre = (((heading - pano_heading) / 360.0 + 0.5) % 1.0) * cols
+        first = math.floor(centre - half / 360.0 * cols)
+        last = math.ceil(centre + half / 360.0 * cols) - 1
+        col_range = [col % cols for col in range(first, last + 1)][:cols]
+    return [(row, col) for row in row_range for col in col_range]
+
+async def _fetch_slice(url, pos, on_slice):
+    data = await asyncio.get_running_loop().run_in_executor(executor, grab_img_baidu, url)
+    if data and on_slice is not None:
+        on_slice(pos, data)
+    return data
+
+# Download every slice of one pano concurrently, returns {(row, col): bytes or None}.
+# on_slice(pos, data) is called for each slice as soon as it arrives.
+async def fetch_pano_slices_async(sid, z=4, positions=None, on_slice=None):
+    positions = positions or level_positions(z)
+    urls = [PDATA_URL.format(sid=sid, row=row, col=col, z=z) for row, col in positions]
+    results = await asyncio.gather(*(_fetch_slice(url, pos, on_slice) for pos, url in zip(positions, urls)),
+                                   return_exceptions=True)
+    slices = {}
+    for pos, url, result in zip(positions, urls, results):
+        if isinstance(result, Exception):
+            print(f"    Error in downloading {url}: {result}")
+            result = None
+        slices[pos] = result
+    return slices
+
+# Download several panos at once, all slices share the global concurrency cap
+async def fetch_panos_async(sids, z=4, positions=None):
+    results = await asyncio.gather(*(fetch_pano_slices_async(sid, z, positions) for sid in sids))
+    return dict(zip(sids, results))
+
+# Write through a temporary file, so a slice cut off by a crash is never read back
+def _write_slice(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# partial_dir keeps every slice as soon as it arrives, so an interrupted pano is resumed
+# by downloading only the slices missing from it
+def fetch_pano_slices(sid, z=4, positions=None, partial_dir=None):
+    positions = positions or level_positions(z)
+    if partial_dir is None:
+        return asyncio.run(fetch_pano_slices_async(sid, z, positions))
+
+    os.makedirs(partial_dir, exist_ok=True)
+    slices = {}
+    for row, col in positions:
+        path = os.path.join(partial_dir, f"{row}_{col}")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                slices[(row, col)] = f.read()
+    missing = [pos for pos in positions if pos not in slices]
+    if missing:
+        def keep(pos, data):
+            _write_slice(os.path.join(partial_dir, f"{pos[0]}_{pos[1]}"), data)
+        slices.update(asyncio.run(fetch_pano_slices_async(sid, z, missing, keep)))
+    return {pos: slices[pos] for pos in positions}
+
+def fetch_panos(sids, z=4, positions=None):
+    return asyncio.run(fetch_panos_async(list(sids), z, positions))
+
+# Only the slices of a heading/fov sector, e.g. the forward view, instead of the whole band.
+# pano_heading defaults to the one in the pano's sdata. Returns (positions, slices), or
+# (None, {}) when the heading is unknown.
+def fetch_sector(sid, heading, fov, pitch_range=None, z=4, pano_heading=None, partial_dir=None):
+    if pano_heading is None:
+        pano_heading = get_pano_heading(sid)
+        if pano_heading is None:
+            return None, {}
+    positions = sector_positions(z, heading, fov, pitch_range, pano_heading)
+    return positions, fetch_pano_slices(sid, z, positions, partial_dir)
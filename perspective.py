@@ -0,0 +1,106 @@
+import glob
+import os
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+
+# Bilinear sampling grid from a perspective view into an equirectangular panorama of
+# pano_width x pano_height. The panorama spans 360 degrees horizontally and is assumed centred
+# on the horizon vertically (the z=4 band covers +-45 degrees). heading 0 looks at the centre
+# column and grows to the right, pitch grows upwards, fov is horizontal; all in degrees.
+# Returns the flat source indices of the 4 neighbours, their weights and a mask of the output
+# pixels that fall inside the panorama. Grids are cached, so batches of panos reuse them.
+@lru_cache(maxsize=64)
+def sampling_grid(heading, pitch, fov, width, height, pano_width, pano_height):
+    f = (width / 2) / np.tan(np.radians(fov) / 2)
+    x = np.arange(width, dtype=np.float64) + 0.5 - width / 2
+    y = height / 2 - (np.arange(height, dtype=np.float64) + 0.5)
+    x, y = np.meshgrid(x, y)
+
+    p, h = np.radians(pitch), np.radians(heading)
+    y_p = y * np.cos(p) + f * np.sin(p)
+    z_p = -y * np.sin(p) + f * np.cos(p)
+    X = x * np.cos(h) + z_p * np.sin(h)
+    Z = -x * np.sin(h) + z_p * np.cos(h)
+    lon = np.arctan2(X, Z)
+    lat = np.arctan2(y_p, np.hypot(X, Z))
+
+    v_span = 2 * np.pi * pano_height / pano_width
+    u = (lon / (2 * np.pi) + 0.5) * pano_width - 0.5
+    v = (v_span / 2 - lat) / v_span * pano_height - 0.5
+    inside = (v >= -0.5) & (v <= pano_height - 0.5)
+
+    u0 = np.floor(u)
+    v0 = np.floor(v)
+    du = (u - u0).astype(np.float32)
+    dv = (v - v0).astype(np.float32)
+    u0 = u0.astype(np.int64) % pano_width
+    u1 = (u0 + 1) % pano_width
+    v0 = v0.astype(np.int64)
+    v1 = np.clip(v0 + 1, 0, pano_height - 1)
+    v0 = np.clip(v0, 0, pano_height - 1)
+
+    index = np.stack([v0 * pano_width + u0, v0 * pano_width + u1,
+                      v1 * pano_width + u0, v1 * pano_width + u1]).reshape(4, -1)
+    weight = np.stack([(1 - du) * (1 - dv), du * (1 - dv), (1 - du) * dv, du * dv]).reshape(4, -1)
+    weight *= inside.reshape(1, -1)
+    for array in (index, weight):
+        array.flags.writeable = False
+    return index, weight
+
+# Cut views from a batch of equally sized panoramas, shape (N, H, W, C) uint8 (a single
+# (H, W, C) pano also works). views is a list of (heading, pitch, fov); returns one
+# (N, height, width, C) uint8 array per view.
+def remap(panos, views, width=512, height=512):
+    panos = np.asarray(panos)
+    single = panos.ndim == 3
+    if single:
+        panos = panos[None]
+    n, pano_height, pano_width, channels = panos.shape
+    flat = panos.reshape(n, pano_height * pano_width, channels)
+    results = []
+    for heading, pitch, fov in views:
+        index, weight = sampling_grid(float(heading), float(pitch), float(fov), width, height,
+                                      pano_width, pano_height)
+        out = np.zeros((n, width * height, channels), dtype=np.float32)
+        for k in range(4):
+            out += flat[:, index[k]] * weight[k][None, :, None]
+        out = np.clip(out + 0.5, 0, 255).astype(np.uint8).reshape(n, height, width, channels)
+        results.append(out[0] if single else out)
+    return results
+
+# Decode a stitched panorama once and cut every view from it, returns PIL images
+def extract_views(pano, views, width=512, height=512):
+    if isinstance(pano, Image.Image):
+        pano = np.asarray(pano.convert("RGB"))
+    return [Image.fromarray(view) for view in remap(pano, views, width, height)]
+
+# Views of every *_final.png in final_dir, saved as {name}_h{heading}_p{pitch}_f{fov}.jpg.
+# Panos of the same size are decoded batch_size at a time and share the cached grids.
+def extract_dir(final_dir, output_dir, views, width=512, height=512, batch_size=8):
+    os.makedirs(output_dir, exist_ok=True)
+    paths = sorted(glob.glob(os.path.join(final_dir, "*_final.png")))
+    by_size = {}
+    for path in paths:
+        with Image.open(path) as img:
+            by_size.setdefault(img.size, []).append(path)
+    for size_paths in by_size.values():
+        for start in range(0, len(size_paths), batch_size):
+            batch = size_paths[start:start + batch_size]
+            panos = np.stack([np.asarray(Image.open(path).convert("RGB")) for path in batch])
+            for (heading, pitch, fov), out in zip(views, remap(panos, views, width, height)):
+                for path, view in zip(batch, out):
+                    name = os.path.basename(path)[:-len("_final.png")]
+                    save_path = os.path.join(output_dir, f"{name}_h{heading:g}_p{pitch:g}_f{fov:g}.jpg")
+                    Image.fromarray(view).save(save_path, quality=95)
+            print(f"    {len(batch)} panos x {len(views)} views saved to {output_dir}")
+
+
+if __name__ == "__main__":
+    root = "Images_output"
+    dir = "By_High_Dpi"
+    # Four 90 degree views around the pano
+    views = [(heading, 0, 90) for heading in (0, 90, 180, 270)]
+    extract_dir(os.path.join(root, dir, "Final"), os.path.join(root, dir, "Views"), views)
@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pano_download
+import stitch
+
+_STOP = object()
+
+
+def _mp_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+# Producer/consumer pipeline: I/O threads download slices and push them onto a bounded queue,
+# a dispatcher thread hands them to a process pool that decodes, stitches and encodes.
+# Both sides block when the other falls behind, so memory stays bounded. submit() itself
+# blocks once fetch_threads * 2 panos are waiting, so a long source is never queued whole.
+class PanoPipeline:
+    def __init__(self, workers=None, fetch_threads=4, queue_size=8):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.fetchers = ThreadPoolExecutor(max_workers=fetch_threads)
+        # Workers are started by the dispatcher thread while fetch threads run and print; a
+        # forked child could inherit one of their locks held, so they come from a fork server
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+        # At most two jobs per worker are handed to the pool at once
+        self.in_flight = threading.BoundedSemaphore(self.workers * 2)
+        # At most two panos per fetch thread are queued or being downloaded
+        self.pending = threading.BoundedSemaphore(fetch_threads * 2)
+        self.errors = []
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Queue a pano for download; stitching happens in the process pool once all slices arrived.
+    # on_progress(sid, stage) is called with "fetched", "stitched" or "failed".
+    # pyramid_path/pyramid_levels save lower zoom levels derived from the one fetched at z; without
+    # explicit positions the full sphere is then fetched, so they match the real lower levels.
+    # archive: shard_store.PanoEntry to pack the outputs into shards instead of files.
+    def submit(self, sid, final_path, slice_path=None, row_path=None, z=4, positions=None,
+               partial_dir=None, on_progress=None, pyramid_path=None, pyramid_levels=(), archive=None):
+        self.pending.acquire()
+        try:
+            return self.fetchers.submit(self._fetch, sid, final_path, slice_path, row_path, z, positions,
+                                        partial_dir, on_progress, pyramid_path, pyramid_levels, archive)
+        except BaseException:
+            self.pending.release()
+            raise
+
+    # Queue any picklable CPU-bound call (e.g. an image encode) for the process pool
+    def submit_cpu(self, func, *args):
+        self._put(func, args)
+
+    def _put(self, func, args, on_done=None):
+        self.queue.put((func, args, on_done))
+
+    # Errors of a fetch are logged and recorded and the pano reported failed, instead of
+    # vanishing into a future nobody reads
+    def _fetch(self, sid, final_path, slice_path, row_path, z, positions, partial_dir, on_progress,
+               pyramid_path, pyramid_levels, archive):
+        try:
+            return self._fetch_pano(sid, final_path, slice_path, row_path, z, positions, partial_dir, on_progress,
+                                    pyramid_path, pyramid_levels, archive)
+        except Exception as error:
+            print(f"    Error in fetching {sid}: {error!r}")
+            self.errors.append(error)
+            if on_progress:
+                try:
+                    on_progress(sid, "failed")
+                except Exception as progress_error:
+                    print(f"    Error in recording {sid} as failed: {progress_error!r}")
+            return False
+        finally:
+            self.pending.release()
+
+    def _fetch_pano(self, sid, final_path, slice_path, row_path, z, positions, partial_dir, on_progress,
+                    pyramid_path, pyramid_levels, archive):
+        positions = positions or pano_download.level_positions(z, full=bool(pyramid_levels))
+        slices = pano_download.fetch_pano_slices(sid, z, positions, partial_dir)
+        if not stitch.complete(slices, positions):
+            print(f"    Incomplete slices for {sid}, skip stitching")
+            if on_progress:
+                on_progress(sid, "failed")
+            return False
+        on_done = None
+        if on_progress:
+            on_progress(sid, "fetched")
+            on_done = lambda ok: on_progress(sid, "stitched" if ok else "failed")
+        self._put(stitch.save_panorama,
+                  (slices, final_path, slice_path, row_path, pyramid_path, z, pyramid_levels, archive), on_done)
+        return True
+
+    def _dispatch(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            func, args, on_done = item
+            self.in_flight.acquire()
+            future = self.pool.submit(func, *args)
+            future.add_done_callback(lambda f, on_done=on_done: self._done(f, on_done))
+
+    def _done(self, future, on_done):
+        self.in_flight.release()
+        error = future.exception()
+        if error is not None:
+            print(f"    Error in image worker: {error}")
+            self.errors.append(error)
+        if on_done:
+            on_done(error is None)
+
+    def close(self):
+        self.fetchers.shutdown(wait=True)
+        self.queue.put(_STOP)
+        self.dispatcher.join()
+        self.pool.shutdown(wait=True)
+        if self.errors:
+            print(f"    {len(self.errors)} panos or images failed, rerun to retry them")
+        return self.errors
@@ -0,0 +1,112 @@
+import csv
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from coord_convert import wgs84tobd09mc
+from geoconv import wgs2bd09mc_batch
+
+CHUNK_SIZE = 10000
+
+# wgs_x/wgs_y keep the CSV text (used in file names), lng/lat/bd09mc_* are float arrays.
+# rows are the row numbers of the points in the file, header excluded, skipped rows counted.
+PointChunk = namedtuple("PointChunk", ["rows", "wgs_x", "wgs_y", "lng", "lat", "bd09mc_x", "bd09mc_y"])
+
+
+def _column(header, col):
+    if isinstance(col, int):
+        return col
+    try:
+        return header.index(col)
+    except ValueError:
+        raise KeyError(f"Column {col!r} not in {header}")
+
+# Stream (rows, wgs_x, wgs_y) chunks of a CSV without loading it. Columns are given by name
+# (or index); rows whose coordinates do not parse are skipped.
+def iter_csv_chunks(filepath, x_col="Lon", y_col="Lat", chunk_size=CHUNK_SIZE):
+    if not os.path.exists(filepath):
+        print(f'File path error: {filepath}')
+        return
+    with open(filepath, mode='r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        xi, yi = _column(header, x_col), _column(header, y_col)
+        rows, xs, ys = [], [], []
+        for n, line in enumerate(reader):
+            try:
+                x, y = line[xi], line[yi]
+                float(x), float(y)
+            except (IndexError, ValueError):
+                continue
+            rows.append(n)
+            xs.append(x)
+            ys.append(y)
+            if len(xs) >= chunk_size:
+                yield rows, xs, ys
+                rows, xs, ys = [], [], []
+        if xs:
+            yield rows, xs, ys
+
+# Same as iter_csv_chunks for the Parquet/Feather output of Convert_Coordinates.py, reading only
+# the two coordinate columns
+def iter_arrow_chunks(filepath, x_col="Lon", y_col="Lat", chunk_size=CHUNK_SIZE):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    if filepath.lower().endswith(".parquet"):
+        batches = pq.ParquetFile(filepath).iter_batches(batch_size=chunk_size, columns=[x_col, y_col])
+    else:
+        reader = pa.ipc.open_file(filepath)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    start = 0
+    for batch in batches:
+        for offset in range(0, batch.num_rows, chunk_size):
+            part = batch.slice(offset, chunk_size)
+            # Rows with a null coordinate are skipped, as unparseable CSV rows are
+            valid = pc.and_(pc.is_valid(part.column(x_col)), pc.is_valid(part.column(y_col)))
+            rows = [start + i for i, ok in enumerate(valid.to_pylist()) if ok]
+            xs = [str(v) for v in pc.filter(part.column(x_col), valid).to_pylist()]
+            ys = [str(v) for v in pc.filter(part.column(y_col), valid).to_pylist()]
+            start += part.num_rows
+            if xs:
+                yield rows, xs, ys
+
+def iter_file_chunks(filepath, x_col="Lon", y_col="Lat", chunk_size=CHUNK_SIZE):
+    if os.path.splitext(filepath)[1].lower() in (".parquet", ".feather", ".arrow"):
+        return iter_arrow_chunks(filepath, x_col, y_col, chunk_size)
+    return iter_csv_chunks(filepath, x_col, y_col, chunk_size)
+
+# Stream chunks already converted to BD09MC, offline by default or through batched geoconv
+# when an AK is given. Memory stays at one chunk whatever the file size.
+def iter_points(filepath, x_col="Lon", y_col="Lat", ak=None, chunk_size=CHUNK_SIZE):
+    for rows, xs, ys in iter_file_chunks(filepath, x_col, y_col, chunk_size):
+        lng = np.array(xs, dtype=np.float64)
+        lat = np.array(ys, dtype=np.float64)
+        if ak:
+            mc_x, mc_y = wgs2bd09mc_batch(lng, lat, ak)
+        else:
+            mc_x, mc_y = wgs84tobd09mc(lng, lat)
+        yield PointChunk(rows, xs, ys, lng, lat, mc_x, mc_y)
+
+def read_header(filepath):
+    if os.path.splitext(filepath)[1].lower() in (".parquet", ".feather", ".arrow"):
+        import pyarrow.parquet as pq
+        import pyarrow as pa
+        if filepath.lower().endswith(".parquet"):
+            return pq.read_schema(filepath).names
+        return pa.ipc.open_file(filepath).schema.names
+    with open(filepath, mode='r', encoding='utf-8-sig', newline='') as f:
+        return next(csv.reader(f), [])
+
+# Flatten converted chunks into (i, wgs_x, wgs_y, bd09mc_x, bd09mc_y), points whose conversion
+# failed are skipped
+def iter_converted(filepath, x_col="Lon", y_col="Lat", ak=None, chunk_size=CHUNK_SIZE):
+    for chunk in iter_points(filepath, x_col, y_col, ak, chunk_size):
+        for j in range(len(chunk.wgs_x)):
+            if np.isnan(chunk.bd09mc_x[j]):
+                continue
+            yield chunk.rows[j], chunk.wgs_x[j], chunk.wgs_y[j], chunk.bd09mc_x[j], chunk.bd09mc_y[j]
@@ -0,0 +1,107 @@
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+# Requests per second and burst size of each endpoint
+RATES = {
+    "tile": (8.0, 8),
+    "pdata": (20.0, 16),
+    "qsdata": (2.0, 2),
+    "sdata": (2.0, 2),
+    "geoconv": (5.0, 5),
+    "other": (2.0, 2),
+}
+
+# Statuses that mean we are going too fast or the server is struggling
+BACKOFF_STATUS = {403, 429, 500, 502, 503, 504}
+
+
+def endpoint_of(url):
+    parsed = urlparse(url)
+    if parsed.netloc == "api.map.baidu.com" and "geoconv" in parsed.path:
+        return "geoconv"
+    if parsed.netloc.endswith("bdimg.com"):
+        qt = parse_qs(parsed.query).get("qt", [""])[0]
+        if qt in RATES:
+            return qt
+    return "other"
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a token is available and take it
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Token bucket whose rate halves on every throttling response and creeps back up
+# towards the configured ceiling on successes (AIMD)
+class AdaptiveLimiter:
+    def __init__(self, rate, burst, min_rate=0.05, recover=0.05):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.recover = recover
+        self.bucket = TokenBucket(rate, burst)
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        self.bucket.acquire()
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            bucket = self.bucket
+            bucket.rate = min(self.max_rate, bucket.rate + self.max_rate * self.recover)
+
+    # Returns how long the caller should sleep before retrying
+    def throttled(self):
+        with self.lock:
+            self.failures += 1
+            bucket = self.bucket
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            bucket.tokens = min(bucket.tokens, 0)
+            return min(60.0, 2 ** (self.failures - 1))
+
+
+class RateLimiter:
+    def __init__(self, rates=None):
+        self.rates = dict(RATES, **(rates or {}))
+        self.limiters = {name: AdaptiveLimiter(rate, burst) for name, (rate, burst) in self.rates.items()}
+
+    def limiter(self, url):
+        return self.limiters[endpoint_of(url)]
+
+    def wait(self, url):
+        self.limiter(url).wait()
+
+    def success(self, url):
+        self.limiter(url).success()
+
+    def throttled(self, url):
+        return self.limiter(url).throttled()
+
+
+# Shared by every script in the process
+limiter = RateLimiter()
+
+# Replace the shared limiter, rates maps endpoints to (requests per second, burst)
+def configure(rates=None):
+    global limiter
+    limiter = RateLimiter(rates)
+    return limiter
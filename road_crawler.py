@@ -0,0 +1,200 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import coord_convert
+import pano_download
+from checkpoint import DB_PATH, Journal
+from pano_catalog import PanoCatalog
+from pipeline import PanoPipeline
+from sid_store import SidStore
+
+# sdata requests in flight per crawl step
+BATCH_SIZE = pano_download.MAX_CONCURRENCY
+QUEUED = 0
+EXPANDED = 1
+FAILED = 2
+
+
+# Even-odd test of BD09MC points against a polygon [(x, y), ...], vectorized over the points
+def inside_polygon(x, y, polygon):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    poly = np.asarray(polygon, dtype=np.float64)
+    px, py = poly[:, 0], poly[:, 1]
+    qx, qy = np.roll(px, -1), np.roll(py, -1)
+    crosses = (py[:, None] > y) != (qy[:, None] > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        at_x = px[:, None] + (y - py[:, None]) * (qx - px)[:, None] / (qy - py)[:, None]
+    return np.count_nonzero(crosses & (x < at_x), axis=0) % 2 == 1
+
+def wgs_polygon(polygon):
+    lng, lat = np.asarray(polygon, dtype=np.float64).T
+    return np.column_stack(coord_convert.wgs84tobd09mc(lng, lat))
+
+# Neighbouring panos (pid, x, y) along every road of an sdata content, positions in BD09MC
+def neighbours(sdata):
+    result = []
+    for road in (sdata or {}).get("Roads") or []:
+        for pano in road.get("Panos") or []:
+            try:
+                result.append((pano["PID"], float(pano["X"]) / 100, float(pano["Y"]) / 100))
+            except (KeyError, TypeError, ValueError):
+                continue
+    return result
+
+
+# Persistent visited set and frontier of the crawl. Every PID ever seen has a row, so it is
+# queued at most once; PIDs are popped nearest to the area centre first and marked expanded once
+# their sdata was handled, so a crawl stopped at any point resumes from the saved frontier.
+# PIDs whose sdata could not be fetched are marked failed and queued again by the next crawl.
+class Frontier:
+    def __init__(self, scope, path=DB_PATH):
+        self.scope = scope
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS frontier (scope TEXT NOT NULL, pid TEXT NOT NULL, "
+                          "priority REAL NOT NULL, state INTEGER NOT NULL, updated REAL, "
+                          "PRIMARY KEY (scope, pid)) WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS frontier_queue ON frontier (scope, state, priority)")
+
+    # Returns how many of the (pid, priority) pairs were new
+    def push(self, items):
+        now = time.time()
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO frontier (scope, pid, priority, state, updated) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  [(self.scope, pid, priority, QUEUED, now) for pid, priority in items])
+            return self.conn.total_changes - before
+
+    def pop(self, n):
+        with self.lock:
+            rows = self.conn.execute("SELECT pid FROM frontier WHERE scope = ? AND state = ? "
+                                     "ORDER BY priority LIMIT ?", (self.scope, QUEUED, n)).fetchall()
+        return [row[0] for row in rows]
+
+    def _set_state(self, pids, state):
+        with self.lock:
+            self.conn.executemany("UPDATE frontier SET state = ?, updated = ? WHERE scope = ? AND pid = ?",
+                                  [(state, time.time(), self.scope, pid) for pid in pids])
+
+    def expanded(self, pids):
+        self._set_state(pids, EXPANDED)
+
+    def failed(self, pids):
+        self._set_state(pids, FAILED)
+
+    # Queue the PIDs an earlier run failed on again, returns how many
+    def retry_failed(self):
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.execute("UPDATE frontier SET state = ?, updated = ? WHERE scope = ? AND state = ?",
+                              (QUEUED, time.time(), self.scope, FAILED))
+            return self.conn.total_changes - before
+
+    def counts(self):
+        rows = self.conn.execute("SELECT state, COUNT(*) FROM frontier WHERE scope = ? GROUP BY state",
+                                 (self.scope,)).fetchall()
+        counts = dict(rows)
+        return counts.get(QUEUED, 0), counts.get(EXPANDED, 0), counts.get(FAILED, 0)
+
+    def close(self):
+        self.conn.close()
+
+
+async def _fetch_sdata(pids):
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(loop.run_in_executor(pano_download.executor, pano_download.get_sdata, pid)
+                                  for pid in pids))
+
+# Walk the pano graph from the seed SIDs through the Roads/Panos lists of each sdata, staying
+# inside polygon (BD09MC vertices). Each pano costs one sdata request, neighbours come with their
+# positions so those outside the polygon are never requested. Panos whose sdata request failed
+# (throttled, network error, offline cache miss) are left for the next run. Every pano reached is recorded in
+# the catalog and, with a pipeline, downloaded into output_dir. max_panos bounds one run.
+# on_pano(pid, sdata), when given, replaces the built-in download and returns the saved path.
+# The built-in download needs journal and sid_store alongside the pipeline to claim each pano once.
+def crawl(seeds, polygon, frontier, catalog, pipeline=None, journal=None, sid_store=None, output_dir=None,
+          z=4, batch_size=BATCH_SIZE, max_panos=None, on_pano=None):
+    if on_pano is None and pipeline is not None and (journal is None or sid_store is None or output_dir is None):
+        raise ValueError("crawl() with a pipeline needs journal, sid_store and output_dir")
+    polygon = np.asarray(polygon, dtype=np.float64)
+    centre = polygon.mean(axis=0)
+    retried = frontier.retry_failed()
+    if retried:
+        print(f"    Retrying {retried} panos whose sdata failed before")
+    frontier.push((sid, 0.0) for sid in seeds)
+    expanded = 0
+    while max_panos is None or expanded < max_panos:
+        pids = frontier.pop(batch_size)
+        if not pids:
+            break
+        handled, failed = [], []
+        for pid, sdata in zip(pids, asyncio.run(_fetch_sdata(pids))):
+            if sdata is None:
+                print(f"    No sdata for {pid}, left for the next run")
+                failed.append(pid)
+                continue
+            final_path = None
+            if on_pano is not None:
+                final_path = on_pano(pid, sdata)
+            elif pipeline is not None and journal.claim_pano(pid, sid_store):
+                final_path = os.path.join(output_dir, "Final", f"{pid}_final.png")
+                partial_dir = os.path.join(output_dir, "Partial", pid)
+                journal.start_pano(pid, final_path=final_path, slice_path=None, row_path=None,
+                                   partial_dir=partial_dir, z=z)
+                pipeline.submit(pid, final_path, z=z, partial_dir=partial_dir, on_progress=journal.pano_progress)
+            catalog.add_pano(pid, sdata, final_path)
+            found = neighbours(sdata)
+            if found:
+                xy = np.array([(x, y) for _, x, y in found])
+                keep = inside_polygon(xy[:, 0], xy[:, 1], polygon)
+                distance = np.hypot(xy[:, 0] - centre[0], xy[:, 1] - centre[1])
+                frontier.push((found[i][0], float(distance[i])) for i in np.nonzero(keep)[0])
+            handled.append(pid)
+        frontier.expanded(handled)
+        frontier.failed(failed)
+        expanded += len(handled)
+        queued, done, failures = frontier.counts()
+        print(f"    {done} panos expanded, {queued} in the frontier, {failures} failed")
+    return expanded
+
+
+if __name__ == "__main__":
+    root = "Images_output"
+    dir = "By_Road"
+    seeds = ["Your seed SID"]       # One or more SIDs inside the area, e.g. from qt=qsdata
+    # Area to cover as WGS84 (lng, lat) vertices
+    area = [(120.63036, 31.384998), (120.644374, 31.384998), (120.644374, 31.379819), (120.63036, 31.379819)]
+    download = True         # False only walks the graph and fills the catalog
+    z = 4
+    cache_dir = "http_cache"    # Cache of sdata/pdata responses, None to disable
+    offline = False         # Only serve responses from the cache
+
+    output_dir = os.path.join(root, dir)
+    os.makedirs(os.path.join(output_dir, "Final"), exist_ok=True)
+    if cache_dir:
+        pano_download.enable_cache(cache_dir, offline=offline)
+    frontier = Frontier(dir)
+    catalog = PanoCatalog(dir)
+    journal = Journal(dir)
+    sid_store = SidStore(dir)
+    pipeline = PanoPipeline() if download else None
+
+    if pipeline is not None:
+        for sid, info in journal.resume_panos():
+            print(f"Resuming pano {sid}...")
+            pipeline.submit(sid, info["final_path"], z=info.get("z", 4), partial_dir=info["partial_dir"],
+                            on_progress=journal.pano_progress)
+
+    total = crawl(seeds, wgs_polygon(area), frontier, catalog, pipeline, journal, sid_store, output_dir, z)
+    if pipeline is not None:
+        pipeline.close()
+    print(f"Completed! {total} panos expanded")
@@ -0,0 +1,97 @@
+import numpy as np
+
+# 8-neighbourhood offsets (dy, dx) and the length of a step to each neighbour
+OFFSETS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+STEPS = np.array([1.0 if dy == 0 or dx == 0 else np.sqrt(2.0) for dy, dx in OFFSETS])
+
+
+def blue_mask(img, threshold=100):
+    img_array = np.array(img.convert("RGB"))
+    return img_array[:, :, 2] > threshold
+
+# Zhang-Suen thinning, each sub-iteration removes all deletable border pixels at once
+def skeletonize(mask):
+    skel = np.asarray(mask, dtype=np.uint8).copy()
+    while True:
+        changed = False
+        for step in (0, 1):
+            P = np.pad(skel, 1)
+            p2, p3, p4, p5 = P[:-2, 1:-1], P[:-2, 2:], P[1:-1, 2:], P[2:, 2:]
+            p6, p7, p8, p9 = P[2:, 1:-1], P[2:, :-2], P[1:-1, :-2], P[:-2, :-2]
+            ring = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+            B = sum(ring[:8])
+            A = sum((ring[i] == 0) & (ring[i + 1] == 1) for i in range(8))
+            if step == 0:
+                cond = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                cond = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            remove = (skel == 1) & (B >= 2) & (B <= 6) & (A == 1) & cond
+            if remove.any():
+                skel[remove] = 0
+                changed = True
+        if not changed:
+            return skel.astype(bool)
+
+# Pixel graph of a skeleton: coordinates of its pixels and, for each one, the index of its
+# 8 neighbours (-1 where there is none)
+def pixel_graph(skel):
+    ys, xs = np.nonzero(skel)
+    index = np.full((skel.shape[0] + 2, skel.shape[1] + 2), -1, dtype=np.int64)
+    index[ys + 1, xs + 1] = np.arange(len(ys))
+    neighbours = np.stack([index[ys + 1 + dy, xs + 1 + dx] for dy, dx in OFFSETS], axis=1)
+    return ys, xs, neighbours
+
+# Connected component labels by min-label propagation with pointer jumping
+def label_components(neighbours):
+    n = len(neighbours)
+    labels = np.arange(n)
+    has = neighbours >= 0
+    while True:
+        around = np.where(has, labels[np.where(has, neighbours, 0)], n).min(axis=1, initial=n)
+        new = np.minimum(labels, around)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+# Geodesic distance along the skeleton from one seed per component. The seed is an end point
+# of the segment when it has one, otherwise (closed loops) its lowest-index pixel.
+def geodesic_distance(neighbours, labels):
+    n = len(neighbours)
+    has = neighbours >= 0
+    endpoint = has.sum(axis=1) == 1
+    key = np.where(endpoint, np.arange(n), np.arange(n) + n)
+    best = np.full(n, 2 * n)
+    np.minimum.at(best, labels, key)
+    seeds = np.unique(best[labels] % n)
+
+    dist = np.full(n, np.inf)
+    dist[seeds] = 0.0
+    safe = np.where(has, neighbours, 0)
+    while True:
+        reach = np.where(has, dist[safe] + STEPS, np.inf).min(axis=1, initial=np.inf)
+        new = np.minimum(dist, reach)
+        if np.array_equal(new, dist):
+            return dist
+        dist = new
+
+# Sample road pixels every spacing_px pixels along each skeleton polyline of the blue road mask.
+# Returns (row, col) pairs like find_blue_pixels, ordered by segment.
+def sample_road_pixels(img, spacing_px, threshold=100):
+    skel = skeletonize(blue_mask(img, threshold))
+    ys, xs, neighbours = pixel_graph(skel)
+    if len(ys) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    labels = label_components(neighbours)
+    dist = geodesic_distance(neighbours, labels)
+
+    # Keep the first pixel of every spacing_px bucket along the path from the seed
+    has = neighbours >= 0
+    previous = np.where(has, dist[np.where(has, neighbours, 0)], np.inf).min(axis=1, initial=np.inf)
+    bucket = np.floor(dist / spacing_px)
+    sampled = (dist == 0) | (bucket > np.floor(np.minimum(previous, dist) / spacing_px))
+    sampled &= np.isfinite(dist)
+
+    order = np.lexsort((dist[sampled], labels[sampled]))
+    return np.column_stack((ys[sampled], xs[sampled]))[order]
@@ -0,0 +1,138 @@
+import mmap
+import os
+import sqlite3
+import threading
+
+# A shard is closed once it reaches this size and the next one is started
+SHARD_BYTES = 1024 ** 3
+
+
+# Append-only archive of encoded images. Every process appends to its own shard files, so
+# pipeline workers never contend for a file, and a shared SQLite index maps each key
+# (the file name the image would have had) to its shard, offset and length, with the SID,
+# coordinates and slice position alongside. Reads memory-map the shards.
+class ShardArchive:
+    def __init__(self, archive_dir, shard_bytes=SHARD_BYTES):
+        self.archive_dir = archive_dir
+        self.shard_bytes = shard_bytes
+        self.lock = threading.Lock()
+        self.conn = None
+        self.shard = None
+        self.shard_name = None
+        self.maps = {}
+
+    def _index(self):
+        if self.conn is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            self.conn = sqlite3.connect(os.path.join(self.archive_dir, "index.db"), timeout=30,
+                                        check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, sid TEXT, kind TEXT, "
+                              "row INTEGER, col INTEGER, z INTEGER, wgs_x TEXT, wgs_y TEXT, "
+                              "shard TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS blobs_sid ON blobs (sid)")
+        return self.conn
+
+    # Current shard of this process, a new one once it is full
+    def _shard(self):
+        if self.shard is not None and self.shard.tell() < self.shard_bytes:
+            return self.shard
+        if self.shard is not None:
+            self.shard.close()
+        n = 0
+        while True:
+            name = f"shard-{os.getpid()}-{n:05d}.bin"
+            path = os.path.join(self.archive_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) < self.shard_bytes:
+                break
+            n += 1
+        self.shard = open(path, "ab")
+        self.shard_name = name
+        return self.shard
+
+    def put(self, key, data, sid=None, kind=None, row=None, col=None, z=None, wgs_x=None, wgs_y=None):
+        with self.lock:
+            conn = self._index()
+            f = self._shard()
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            conn.execute("INSERT OR REPLACE INTO blobs (key, sid, kind, row, col, z, wgs_x, wgs_y, shard, offset, length) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (key, sid, kind, row, col, z, None if wgs_x is None else str(wgs_x),
+                          None if wgs_y is None else str(wgs_y), self.shard_name, offset, len(data)))
+        return key
+
+    def _view(self, shard, offset, length):
+        mm = self.maps.get(shard)
+        if mm is None or len(mm) < offset + length:
+            # Shards still being appended to are remapped once a read goes past the old end
+            with open(os.path.join(self.archive_dir, shard), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[shard] = mm
+        return memoryview(mm)[offset:offset + length]
+
+    # Zero-copy view of the bytes stored under key, None if absent
+    def get(self, key):
+        row = self._index().execute("SELECT shard, offset, length FROM blobs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return self._view(*row)
+
+    def __contains__(self, key):
+        return self._index().execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone() is not None
+
+    # Index rows (key, kind, row, col, z, wgs_x, wgs_y) of everything stored for a SID
+    def entries(self, sid):
+        return self._index().execute("SELECT key, kind, row, col, z, wgs_x, wgs_y FROM blobs WHERE sid = ? "
+                                     "ORDER BY key", (sid,)).fetchall()
+
+    # (wgs_x, wgs_y) of every point with a stored final image, replaces listing the Final directory
+    def points(self):
+        return {(x, y) for x, y in self._index().execute("SELECT wgs_x, wgs_y FROM blobs WHERE kind = 'final'")}
+
+    def pano(self, sid, wgs_x=None, wgs_y=None):
+        return PanoEntry(self, sid, wgs_x, wgs_y)
+
+    def close(self):
+        with self.lock:
+            if self.shard is not None:
+                self.shard.close()
+                self.shard = None
+            for mm in self.maps.values():
+                try:
+                    mm.close()
+                except BufferError:
+                    pass        # a view handed out is still alive
+            self.maps = {}
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+# One archive per directory and process, shared by every pano a pipeline worker saves
+_archives = {}
+
+def open_archive(archive_dir, shard_bytes=SHARD_BYTES):
+    key = (os.path.abspath(archive_dir), shard_bytes, os.getpid())
+    if key not in _archives:
+        _archives[key] = ShardArchive(archive_dir, shard_bytes)
+    return _archives[key]
+
+# The outputs of one pano, so stitch.save_panorama can store them without knowing the metadata.
+# Pickles as the archive directory plus metadata and reopens the process's archive on arrival.
+class PanoEntry:
+    def __init__(self, archive, sid, wgs_x=None, wgs_y=None):
+        self.archive = archive
+        self.sid = sid
+        self.wgs_x = wgs_x
+        self.wgs_y = wgs_y
+
+    def put(self, path, data, kind, row=None, col=None, z=None):
+        return self.archive.put(os.path.basename(path), data, sid=self.sid, kind=kind, row=row, col=col, z=z,
+                                wgs_x=self.wgs_x, wgs_y=self.wgs_y)
+
+    def __reduce__(self):
+        return _pano_entry, (self.archive.archive_dir, self.archive.shard_bytes, self.sid, self.wgs_x, self.wgs_y)
+
+def _pano_entry(archive_dir, shard_bytes, sid, wgs_x, wgs_y):
+    return PanoEntry(open_archive(archive_dir, shard_bytes), sid, wgs_x, wgs_y)
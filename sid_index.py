@@ -0,0 +1,61 @@
+import sqlite3
+import threading
+
+from sid_store import DB_PATH
+
+# Query points closer than this (BD09MC units, about metres) to a resolved one reuse its SID
+SNAP_RADIUS = 10.0
+
+
+# Grid index of BD09MC query points whose SID is already known. Cells are snap_radius wide, so a
+# lookup only scans the 3x3 cells around the point. Entries persist in the SID store database.
+class SidIndex:
+    def __init__(self, scope, snap_radius=SNAP_RADIUS, path=DB_PATH):
+        self.scope = scope
+        self.snap_radius = snap_radius
+        self.grid = {}
+        self.lock = threading.Lock()
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS lookups (scope TEXT NOT NULL, x REAL NOT NULL, "
+                              "y REAL NOT NULL, sid TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS lookups_scope ON lookups (scope)")
+            for x, y, sid in self.conn.execute("SELECT x, y, sid FROM lookups WHERE scope = ?", (scope,)):
+                self._insert(x, y, sid)
+
+    def _cell(self, x, y):
+        return int(x // self.snap_radius), int(y // self.snap_radius)
+
+    def _insert(self, x, y, sid):
+        self.grid.setdefault(self._cell(x, y), []).append((x, y, sid))
+
+    # SID of the nearest resolved point within snap_radius, or None
+    def lookup(self, x, y):
+        if self.snap_radius <= 0:
+            return None
+        x, y = float(x), float(y)
+        cx, cy = self._cell(x, y)
+        best, best_sq = None, self.snap_radius ** 2
+        for nx in (cx - 1, cx, cx + 1):
+            for ny in (cy - 1, cy, cy + 1):
+                for px, py, sid in self.grid.get((nx, ny), ()):
+                    d_sq = (px - x) ** 2 + (py - y) ** 2
+                    if d_sq <= best_sq:
+                        best, best_sq = sid, d_sq
+        return best
+
+    def add(self, x, y, sid):
+        if self.snap_radius <= 0:
+            return
+        x, y = float(x), float(y)
+        with self.lock:
+            self._insert(x, y, sid)
+            if self.conn is not None:
+                self.conn.execute("INSERT INTO lookups (scope, x, y, sid) VALUES (?, ?, ?, ?)",
+                                  (self.scope, x, y, sid))
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import threading
+import time
+
+DB_PATH = "panoids.db"
+LEGACY_TXT = "panoids.txt"
+
+
+# Persistent set of fetched SIDs shared by all scripts. Each output directory ("By_Tile",
+# "By_High_Dpi", ...) is its own scope. Membership is answered from an in-memory set loaded
+# once; claiming a SID is an atomic INSERT OR IGNORE, so concurrent processes never both win.
+class SidStore:
+    def __init__(self, scope, path=DB_PATH, legacy_txt=None):
+        self.scope = scope
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sids (scope TEXT NOT NULL, sid TEXT NOT NULL, added REAL, "
+                          "PRIMARY KEY (scope, sid)) WITHOUT ROWID")
+        if legacy_txt and os.path.exists(legacy_txt):
+            self.import_txt(legacy_txt)
+        self.known = {row[0] for row in self.conn.execute("SELECT sid FROM sids WHERE scope = ?", (scope,))}
+
+    def __contains__(self, sid):
+        return sid in self.known
+
+    def __len__(self):
+        return len(self.known)
+
+    # Returns True if this call added the SID, False if it was already stored by anyone
+    def add(self, sid):
+        if sid in self.known:
+            return False
+        with self.lock:
+            cur = self.conn.execute("INSERT OR IGNORE INTO sids (scope, sid, added) VALUES (?, ?, ?)",
+                                    (self.scope, sid, time.time()))
+            self.known.add(sid)
+            return cur.rowcount == 1
+
+    def discard(self, sid):
+        with self.lock:
+            self.conn.execute("DELETE FROM sids WHERE scope = ? AND sid = ?", (self.scope, sid))
+            self.known.discard(sid)
+
+    # One-off import of the old one-SID-per-line panoids.txt
+    def import_txt(self, txt_path):
+        with open(txt_path, 'r') as file:
+            sids = [line.strip() for line in file if line.strip()]
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO sids (scope, sid, added) VALUES (?, ?, NULL)",
+                                  [(self.scope, sid) for sid in sids])
+
+    def close(self):
+        self.conn.close()
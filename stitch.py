@@ -0,0 +1,84 @@
+import os
+from io import BytesIO
+from PIL import Image
+
+
+# Paste decoded slices {(row, col): bytes} straight into one preallocated canvas. Rows and
+# columns are laid out in the order they first appear in slices, so a sector wrapping past
+# column 0 (e.g. columns 7, 0, 1) stays contiguous.
+def stitch_slices(slices):
+    rows = list(dict.fromkeys(row for row, _ in slices))
+    cols = list(dict.fromkeys(col for _, col in slices))
+    tiles = {pos: Image.open(BytesIO(data)) for pos, data in slices.items()}
+    width, height = next(iter(tiles.values())).size
+
+    canvas = Image.new('RGB', (width * len(cols), height * len(rows)))
+    for (row, col), tile in tiles.items():
+        canvas.paste(tile, (cols.index(col) * width, rows.index(row) * height))
+    return canvas
+
+# Lower zoom levels of a canvas stitched at level z, halving the size per level, so thumbnails
+# come from the slices already downloaded. They are the real levels only when the canvas is the
+# full sphere (level_positions(z, full=True)); a band or sector canvas gives reduced crops.
+# Returns {level: image}.
+def pyramid(canvas, z, levels):
+    return {level: canvas.reduce(2 ** (z - level)) for level in sorted(levels, reverse=True) if level < z}
+
+# Write to path, or into the shard archive under the path's file name when one is given
+def _store(path, data, archive, kind, **position):
+    if archive is not None:
+        archive.put(path, data, kind, **position)
+    else:
+        with open(path, "wb") as f:
+            f.write(data)
+
+def encode_image(image, path):
+    buffer = BytesIO()
+    image.save(buffer, format=Image.registered_extensions().get(os.path.splitext(path)[1].lower(), "PNG"))
+    return buffer.getvalue()
+
+# Stitch and encode the panorama once. slice_path and row_path are optional format strings
+# with {row}/{col} (resp. {row}) fields; slices are written as downloaded, without re-encoding,
+# and rows are cropped from the canvas. pyramid_path (a format string with {z}) also saves the
+# pyramid_levels below the fetched level z. archive (a shard_store.PanoEntry) packs every
+# output into shard files instead, keyed by the file names the paths give.
+def save_panorama(slices, final_path, slice_path=None, row_path=None, pyramid_path=None, z=4, pyramid_levels=(),
+                  archive=None):
+    if slice_path:
+        for (row, col), data in slices.items():
+            save_path = slice_path.format(row=row, col=col)
+            _store(save_path, data, archive, "slice", row=row, col=col, z=z)
+            print(f"    Image saved: {save_path}")
+
+    canvas = stitch_slices(slices)
+
+    if row_path:
+        rows = list(dict.fromkeys(row for row, _ in slices))
+        height = canvas.height // len(rows)
+        for i, row in enumerate(rows):
+            save_path = row_path.format(row=row)
+            row_image = canvas.crop((0, i * height, canvas.width, (i + 1) * height))
+            if archive is not None:
+                archive.put(save_path, encode_image(row_image, save_path), "row", row=row, z=z)
+            else:
+                row_image.save(save_path)
+            print(f"    Row merged: {save_path}")
+
+    if archive is not None:
+        archive.put(final_path, encode_image(canvas, final_path), "final", z=z)
+    else:
+        canvas.save(final_path)
+    print(f"    Final image merged: {final_path}")
+
+    if pyramid_path:
+        for level, image in pyramid(canvas, z, pyramid_levels).items():
+            save_path = pyramid_path.format(z=level)
+            if archive is not None:
+                archive.put(save_path, encode_image(image, save_path), "pyramid", z=level)
+            else:
+                image.save(save_path)
+            print(f"    Level {level} saved: {save_path}")
+    return final_path
+
+def complete(slices, expected):
+    return all(slices.get(pos) for pos in expected)
@@ -0,0 +1,99 @@
+import asyncio
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import coord_convert
+import pano_download
+from road_sampler import blue_mask
+
+TILE_URL = "https://mapsv0.bdimg.com/tile/?udt=20200825&qt=tile&styles=pl&x={x}&y={y}&z={z}"
+TILE_SIZE = 256
+# Levels checked for coverage before the target level, coarsest first
+COARSE_LEVELS = (15, 17)
+
+
+# Inclusive (x0, x1, y0, y1) tile range of the bounding box at a level
+def tile_bounds(first_lng, first_lat, end_lng, end_lat, level):
+    x1, y1 = coord_convert.lnglatToTile(first_lng, first_lat, level)
+    x2, y2 = coord_convert.lnglatToTile(end_lng, end_lat, level)
+    return int(min(x1, x2)), int(max(x1, x2)), int(min(y1, y2)), int(max(y1, y2))
+
+# Which of the n x n child tiles of a coverage tile contain blue pixels, as (dx, dy) offsets.
+# Image rows run north to south while tile y grows northwards, hence the flip. Past 256 children
+# per side (more than 8 levels apart) a pixel spans several children and each blue pixel keeps all of them.
+def covered_children(img, n, threshold=100):
+    mask = blue_mask(img, threshold)
+    if mask.shape != (TILE_SIZE, TILE_SIZE):
+        return [(dx, dy) for dx in range(n) for dy in range(n)]
+    if n > TILE_SIZE:
+        span = n // TILE_SIZE
+        rows, cols = np.nonzero(mask)
+        return [(int(col) * span + sx, int(TILE_SIZE - 1 - row) * span + sy)
+                for row, col in zip(rows, cols) for sx in range(span) for sy in range(span)]
+    block = TILE_SIZE // n
+    occupied = mask.reshape(n, block, n, block).any(axis=(1, 3))
+    rows, cols = np.nonzero(occupied)
+    return [(int(col), int(n - 1 - row)) for row, col in zip(rows, cols)]
+
+def fetch_tiles(tiles, level):
+    urls = [TILE_URL.format(x=x, y=y, z=level) for x, y in tiles]
+    results = asyncio.run(pano_download.fetch_urls(urls))
+    images = {}
+    for tile, result in zip(tiles, results):
+        img = None
+        if isinstance(result, bytes):
+            try:
+                img = Image.open(BytesIO(result))
+                img.load()
+            except OSError:
+                img = None
+        images[tile] = img
+    return images
+
+# Tiles of the bounding box at `level` that can hold street view coverage. The coverage tiles
+# of each coarse level are fetched and only the children of their blue blocks are kept, so
+# empty areas cost one coarse request instead of up to 4^(level - coarse) full-level ones.
+# margin: neighbouring children kept around every covered one, since lines are drawn wider
+# or slightly shifted across levels. A coarse tile that fails to download keeps all its children.
+# Returns the tiles and the number of coarse requests made.
+def plan_tiles(first_lng, first_lat, end_lng, end_lat, level=19, coarse_levels=COARSE_LEVELS,
+               margin=1, threshold=100):
+    coarse_levels = sorted(l for l in coarse_levels if l < level)
+    if not coarse_levels:
+        x0, x1, y0, y1 = tile_bounds(first_lng, first_lat, end_lng, end_lat, level)
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)], 0
+
+    x0, x1, y0, y1 = tile_bounds(first_lng, first_lat, end_lng, end_lat, coarse_levels[0])
+    tiles = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    requests = 0
+    for current, child in zip(coarse_levels, coarse_levels[1:] + [level]):
+        n = 2 ** (child - current)
+        x0, x1, y0, y1 = tile_bounds(first_lng, first_lat, end_lng, end_lat, child)
+        images = fetch_tiles(tiles, current)
+        requests += len(tiles)
+        children = set()
+        for (x, y), img in images.items():
+            if img is None:
+                offsets = [(dx, dy) for dx in range(n) for dy in range(n)]
+            else:
+                offsets = covered_children(img, n, threshold)
+            for dx, dy in offsets:
+                cx, cy = x * n + dx, y * n + dy
+                for mx in range(cx - margin, cx + margin + 1):
+                    for my in range(cy - margin, cy + margin + 1):
+                        if x0 <= mx <= x1 and y0 <= my <= y1:
+                            children.add((mx, my))
+        print(f"    Level {current}: {len(tiles)} tiles checked, {len(children)} tiles kept at level {child}")
+        tiles = sorted(children)
+    return tiles, requests
+
+
+if __name__ == "__main__":
+    first_lng, first_lat = 120.63036, 31.384998
+    end_lng, end_lat = 120.644374, 31.379819
+    x0, x1, y0, y1 = tile_bounds(first_lng, first_lat, end_lng, end_lat, 19)
+    full = (x1 - x0 + 1) * (y1 - y0 + 1)
+    tiles, requests = plan_tiles(first_lng, first_lat, end_lng, end_lat)
+    print(f"Full range: {full} tiles, planned: {len(tiles)} tiles + {requests} coverage requests")
@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+
+TILE_SIZE = 256
+# Where downloaded coverage tiles go: nowhere, one compressed TIFF each, or one mosaic
+SINK_MODES = ("none", "tiff", "mosaic")
+
+
+# Tiles are only analysed in memory
+class NoSink:
+    encodes = False
+
+    def write(self, img, tileX, tileY, scale):
+        return None
+
+    def close(self):
+        pass
+
+# One TIFF per tile as before; deflate makes the mostly empty coverage tiles a few KB instead
+# of 192 KB. encodes=True tells callers the write is worth a process pool worker.
+class TiffSink:
+    encodes = True
+
+    def __init__(self, output_dir="Tiles_output", compression="tiff_deflate"):
+        self.output_dir = output_dir
+        self.compression = compression
+
+    def write(self, img, tileX, tileY, scale):
+        os.makedirs(self.output_dir, exist_ok=True)
+        tiff_path = os.path.join(self.output_dir, f"{tileX}_{tileY}_{scale}.tiff")
+        img = img.convert("RGB")
+        if self.compression:
+            img.save(tiff_path, format="TIFF", compression=self.compression)
+        else:
+            img.save(tiff_path, format="TIFF")
+        print(f"    Tile saved at: {tiff_path}")
+        return tiff_path
+
+    def close(self):
+        pass
+
+# All tiles of a range in one tiled, deflate-compressed GeoTIFF. Tiles are copied into a
+# memory-mapped raster next to the output as they arrive (so nothing is encoded per tile and
+# an interrupted run keeps what it wrote), and the raster is encoded once on close. A rerun
+# starts from the finished mosaic, and one that wrote no tile leaves it untouched.
+# Only the ModelPixelScale and ModelTiepoint tags are written, in BD09MC metres, north up; there
+# is no GeoKey directory, so GIS tools open it without a CRS and it has to be assigned by hand.
+# Needs tifffile.
+class MosaicSink:
+    encodes = False
+
+    def __init__(self, path, tiles, scale):
+        import tifffile
+        self.tifffile = tifffile
+        self.path = path
+        self.scale = scale
+        xs = [x for x, _ in tiles]
+        ys = [y for _, y in tiles]
+        self.x0, self.x1 = min(xs), max(xs)
+        self.y0, self.y1 = min(ys), max(ys)
+        shape = ((self.y1 - self.y0 + 1) * TILE_SIZE, (self.x1 - self.x0 + 1) * TILE_SIZE, 3)
+        self.raw_path = f"{path}.raw.npy"
+        raster = None
+        if os.path.exists(self.raw_path):
+            raster = np.lib.format.open_memmap(self.raw_path, mode="r+")
+            if raster.shape != shape:
+                del raster
+                raster = None
+        if raster is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            raster = np.lib.format.open_memmap(self.raw_path, mode="w+", dtype=np.uint8, shape=shape)
+            self._seed(raster)
+        self.raster = raster
+        self.written = 0
+
+    # Copy the mosaic of an earlier run into a new raster, so tiles the journal skips keep their pixels
+    def _seed(self, raster):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with self.tifffile.TiffFile(self.path) as tif:
+                page = tif.pages[0]
+                if page.shape == raster.shape:
+                    page.asarray(out=raster)
+        except (OSError, ValueError) as e:
+            print(f"    Could not read the existing mosaic {self.path}: {e}")
+
+    def write(self, img, tileX, tileY, scale):
+        if not (self.x0 <= tileX <= self.x1 and self.y0 <= tileY <= self.y1):
+            print(f"    Tile {tileX}_{tileY} outside the mosaic, skipped")
+            return None
+        pixels = np.asarray(img.convert("RGB"))[:TILE_SIZE, :TILE_SIZE]
+        # Tile y grows northwards, mosaic rows southwards
+        row = (self.y1 - tileY) * TILE_SIZE
+        col = (tileX - self.x0) * TILE_SIZE
+        self.raster[row:row + pixels.shape[0], col:col + pixels.shape[1]] = pixels
+        self.written += 1
+        return self.path
+
+    def close(self):
+        self.raster.flush()
+        if not self.written and os.path.exists(self.path):
+            del self.raster
+            os.remove(self.raw_path)
+            print(f"    No new tiles, mosaic kept at: {self.path}")
+            return
+        pixel_size = 2.0 ** (18 - self.scale)
+        left = self.x0 * TILE_SIZE * pixel_size
+        top = (self.y1 + 1) * TILE_SIZE * pixel_size
+        extratags = [
+            (33550, 'd', 3, (pixel_size, pixel_size, 0.0), True),            # ModelPixelScale
+            (33922, 'd', 6, (0.0, 0.0, 0.0, left, top, 0.0), True),         # ModelTiepoint
+        ]
+        tmp_path = f"{self.path}.tmp"
+        self.tifffile.imwrite(tmp_path, self.raster, photometric="rgb", tile=(TILE_SIZE, TILE_SIZE),
+                              compression="zlib", bigtiff=self.raster.nbytes > 2 ** 31,
+                              extratags=extratags)
+        os.replace(tmp_path, self.path)
+        del self.raster
+        os.remove(self.raw_path)
+        print(f"    Mosaic saved at: {self.path}")
+
+def open_tile_sink(mode, output_dir="Tiles_output", tiles=None, scale=19):
+    if mode == "none":
+        return NoSink()
+    if mode == "tiff":
+        return TiffSink(output_dir)
+    if mode == "mosaic":
+        if not tiles:
+            return NoSink()
+        return MosaicSink(os.path.join(output_dir, f"mosaic_{scale}.tiff"), tiles, scale)
+    raise ValueError(f"Unknown tile sink {mode!r}, expected one of {SINK_MODES}")